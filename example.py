@@ -9,10 +9,10 @@ from extraction.extractor import ReactionExtractor
 pdf_path = "copper_acetate.pdf"
 
 # Stage I: pdf to text
-# The results will be automatically saved to pdf2text/results
+# The results will be automatically saved to pdf2text/results (in the background)
 print("########## Stage I: PDF-to-Text ##########")
 
-result = parseFile(pdf_path)
+result = parseFile(pdf_path, inMemory=True)
 full_text = result['fullText']  # Text without paragraph information
 paragraphs = result['contents']  # Text with paragraph boundaries
 
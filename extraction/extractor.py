@@ -1,9 +1,152 @@
+import copy
 import sys
+import warnings
 import torch
 from tqdm import tqdm
 import transformers
+from packaging import version
 from peft import PeftModel
-from transformers import GenerationConfig, LlamaForCausalLM, LlamaTokenizer
+from transformers import GenerationConfig, LlamaForCausalLM, LlamaTokenizer, StoppingCriteriaList
+
+from extraction.result_cache import cache_key
+from extraction.training.utils.callbacks import Iteratorize, Stream
+try:
+    from transformers import DynamicCache
+except ImportError:
+    # transformers before 4.36 keep the key/value cache as tuples of tensors
+    DynamicCache = None
+
+# stopping criteria can stop single rows of a batch since transformers 4.39, before that the whole batch stops
+PER_ROW_STOPPING = version.parse(transformers.__version__) >= version.parse("4.39.0")
+
+SYSTEM_PROMPT = "<|system|>\nYou are a helpful assistant in extracting all the chemical reactions from the text provided by the user.\n\n"
+
+class ExtractionStoppingCriteria(transformers.StoppingCriteria):
+    """
+    Ends an answer as soon as
+    - it says there is no complete reaction (such answers are dropped anyway),
+    - its last tokens are one span of at most max_period tokens repeated 3 times or more,
+      over at least min_repeat_tokens tokens (a degenerate loop), unless the repeated span is made of
+      well-formed reaction blocks, since a paragraph may list the same reaction several times, or
+    - it holds max_reactions complete reaction blocks.
+    """
+    def __init__(self, tokenizer, prompt_length, max_reactions=None, stop_repetition=True,
+                 max_period=64, min_repeat_tokens=96):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_reactions = max_reactions
+        self.stop_repetition = stop_repetition
+        self.max_period = max_period
+        self.min_repeat_tokens = min_repeat_tokens
+        self.done = None
+        self.trackers = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids[:, self.prompt_length:]
+        if self.done is None:
+            self.done = torch.zeros(len(input_ids), dtype=torch.bool, device=input_ids.device)
+            self.trackers = [BlockTracker(self.tokenizer) for _ in range(len(input_ids))]
+        if self.stop_repetition:
+            self.done |= self.repeating(generated)
+        for i in torch.nonzero(~self.done).flatten().tolist():
+            tracker = self.trackers[i]
+            tracker.update(generated[i])
+            if tracker.no_complete:
+                self.done[i] = True
+            elif self.max_reactions is not None and tracker.blocks >= self.max_reactions:
+                self.done[i] = True
+        if PER_ROW_STOPPING:
+            return self.done.clone()
+        return bool(self.done.all())
+
+    def repeating(self, generated):
+        # Rows whose last tokens are a short span repeated over and over, other than whole reaction blocks
+        spans = torch.zeros(len(generated), dtype=torch.long, device=generated.device)
+        for period in range(1, self.max_period + 1):
+            span = max(self.min_repeat_tokens, 3 * period)
+            if span > generated.shape[1]:
+                break
+            tail = generated[:, -span:]
+            repeated = (tail[:, period:] == tail[:, :-period]).all(dim=1)
+            spans[repeated & (spans == 0)] = span
+        stuck = spans > 0
+        for i in torch.nonzero(stuck & ~self.done).flatten().tolist():
+            # the span holds at least 3 periods, so blocks between its first and last blank line are whole
+            text = self.tokenizer.decode(generated[i, -spans[i]:], skip_special_tokens=True)
+            blocks = text.split("\n\n")[1:-1]
+            if blocks and all(well_formed_block(block) for block in blocks):
+                stuck[i] = False
+        return stuck
+
+def repeat_cache(cache, repeats):
+    # Copy of a key/value cache with every row repeated, legacy tuples or a Cache object
+    if isinstance(cache, tuple):
+        return tuple(tuple(tensor.repeat_interleave(repeats, dim=0) for tensor in layer) for layer in cache)
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache = copy.deepcopy(cache)
+        if repeats > 1:
+            cache.batch_repeat_interleave(repeats)
+        return cache
+    # DynamicCache before batch_repeat_interleave was added
+    return type(cache).from_legacy_cache(repeat_cache(cache.to_legacy_cache(), repeats))
+
+def well_formed_block(block):
+    # A reaction block as the model writes it: only "key: value" lines, at least two of them, one for the product
+    lines = block.strip().split("\n")
+    keys = [line.split(":", 1)[0].strip() for line in lines if ":" in line]
+    return len(keys) == len(lines) and len(keys) > 1 and "Product" in keys
+
+class BlockTracker:
+    """
+    Follows the reaction blocks of one growing answer. Every update decodes the new tokens plus a short tail
+    to spot a blank line or 'no complete', and the open block once, when it gets closed by a blank line,
+    so the cost stays linear in the length of the answer.
+    """
+    def __init__(self, tokenizer, tail=16):
+        self.tokenizer = tokenizer
+        self.tail = tail
+        self.start = 0  # first token of the open block
+        self.skip = 0  # characters of the first token that belong to the closed blocks
+        self.seen = 0
+        self.blocks = 0
+        self.no_complete = False
+
+    def decode(self, ids, start):
+        text = self.tokenizer.decode(ids[start:], skip_special_tokens=True)
+        return text[self.skip:] if start == self.start else text
+
+    def update(self, ids):
+        """
+        ids: token ids of the answer so far
+        Returns the non-empty blocks closed since the last update.
+        """
+        text = self.decode(ids, max(self.start, self.seen - self.tail))
+        self.seen = len(ids)
+        if 'no complete' in text.lower():
+            self.no_complete = True
+        if "\n\n" not in text:
+            return []
+        pieces = self.decode(ids, self.start).split("\n\n")
+        # the open block starts in the token that ends the last blank line
+        start = len(ids) - 1
+        while start > self.start and len(self.tokenizer.decode(ids[start:], skip_special_tokens=True)) < len(pieces[-1]):
+            start -= 1
+        self.skip = max(0, len(self.tokenizer.decode(ids[start:], skip_special_tokens=True)) - len(pieces[-1]))
+        self.start = start
+        closed = [piece for piece in pieces[:-1] if piece.strip()]
+        self.blocks += len(closed)
+        return closed
+
+def truncate_blocks(text, max_reactions):
+    # First max_reactions reaction blocks of an answer, the whole answer if it has fewer complete ones
+    blocks = text.split("\n\n")
+    count = 0
+    for end, block in enumerate(blocks[:-1]):
+        if block.strip():
+            count += 1
+            if count == max_reactions:
+                return "\n\n".join(blocks[:end + 1])
+    return text
 
 class ReactionExtractor:
     def __init__(
@@ -11,9 +154,14 @@ class ReactionExtractor:
         model_size,
         base_model="meta-llama/Llama-2-7b-hf",
         load_8bit=False,
-        cache_dir=None
+        cache_dir=None,
+        reuse_system_cache=True,
+        result_cache=None
     ):
-        """ Set up model """
+        """ Set up model
+        reuse_system_cache: encode the system prompt once and start every generation from its key/value cache
+        result_cache: optional ExtractionCache of raw answers, see result_cache.py
+        """
         if torch.cuda.is_available():
             self.device = "cuda"
         else:
@@ -28,6 +176,8 @@ class ReactionExtractor:
         # Currently only 7b model size is supported
         assert model_size in ['7b']
         lora_path = f"MingZhong/reaction-miner-{model_size}-lora"
+        self.base_model = base_model
+        self.lora_path = lora_path
 
         self.tokenizer = LlamaTokenizer.from_pretrained(base_model)
         if self.device == "cuda":
@@ -72,6 +222,9 @@ class ReactionExtractor:
             self.model = torch.compile(self.model)
 
         self.excluded_phrases = ["not specified", "not mentioned", "not available", "none"]
+        self.reuse_system_cache = reuse_system_cache
+        self.system_cache = None
+        self.result_cache = result_cache
 
     def get_structured_reactions(self, reaction_string):
         # Parsing each output into a dictionary and filtering out excluded_phrases
@@ -92,6 +245,170 @@ class ReactionExtractor:
                 reactions_dicts.append(reaction_dict)
         return reactions_dicts
 
+    def build_prompt(self, text):
+        return SYSTEM_PROMPT + "<|user|>\n" + text.strip() + "\n\n<|assistant|>\n"
+
+    def length_batches(self, lengths, max_new_tokens, max_batch_tokens=None):
+        """
+        Group segments of similar prompt length into batches whose padded size,
+        batch size * (longest prompt + max_new_tokens), stays within max_batch_tokens.
+        Returns lists of segment indices; one segment per batch if max_batch_tokens is None.
+        """
+        if max_batch_tokens is None:
+            return [[i] for i in range(len(lengths))]
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches, batch = [], []
+        for i in order:
+            # lengths are ascending, so segment i is the longest of the batch
+            if batch and (len(batch) + 1) * (lengths[i] + max_new_tokens) > max_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def load_system_cache(self):
+        """
+        Key/value cache of the system prompt, computed once per model load, and its token ids.
+        Returns None if disabled, or if the model returns no cache (with a warning).
+        """
+        if not self.reuse_system_cache:
+            return None
+        if self.system_cache is None:
+            # the last token may merge with the segment text, leave it out of the cache
+            system_ids = self.tokenizer(SYSTEM_PROMPT + "<|user|>\n")["input_ids"][:-1]
+            kwargs = {} if DynamicCache is None else {"past_key_values": DynamicCache()}
+            with torch.no_grad():
+                output = self.model(input_ids=torch.tensor([system_ids], device=self.device), use_cache=True, **kwargs)
+            if output.past_key_values is None:
+                warnings.warn("reuse_system_cache is set but the model returns no key/value cache, "
+                              "the system prompt is encoded for every segment")
+                self.reuse_system_cache = False
+                return None
+            self.system_cache = (system_ids, output.past_key_values)
+        return self.system_cache
+
+    def prefill(self, input_ids, attention_mask, pad_start):
+        """
+        Key/value cache of all prompt tokens but the last, starting from the system prompt cache.
+        generate() then only feeds the last token, which works with the prefix handling of every
+        transformers version (those before 4.35 keep just the last input token once a cache is given).
+        """
+        past_key_values = repeat_cache(self.system_cache[1], len(input_ids))
+        if input_ids.shape[1] - 1 > pad_start:
+            # positions follow the attention mask, as in generate()
+            position_ids = (attention_mask.long().cumsum(-1) - 1).masked_fill(attention_mask == 0, 1)
+            with torch.no_grad():
+                output = self.model(
+                    input_ids=input_ids[:, pad_start:-1],
+                    attention_mask=attention_mask[:, :-1],
+                    position_ids=position_ids[:, pad_start:-1],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                )
+            past_key_values = output.past_key_values
+        return past_key_values
+
+    def generate_batch(self, batch_ids, generation_config, max_new_tokens, max_reactions=None, stop_repetition=True,
+                       callback=None):
+        # Pad the prompts, generate them together and decode each answer
+        # callback, if given, receives the token ids of the first row after every step (see Stream)
+        pad_token_id = generation_config.pad_token_id
+        max_len = max(len(ids) for ids in batch_ids)
+        system_cache = self.load_system_cache()
+        pad_start = 0
+        if system_cache is not None and all(ids[:len(system_cache[0])] == system_cache[0] for ids in batch_ids):
+            # Every prompt starts with the cached tokens, pad after them instead of on the left;
+            # positions follow the attention mask, so the answers are the same
+            pad_start = len(system_cache[0])
+        input_ids = torch.tensor([ids[:pad_start] + [pad_token_id] * (max_len - len(ids)) + ids[pad_start:] for ids in batch_ids])
+        attention_mask = torch.tensor([[1] * pad_start + [0] * (max_len - len(ids)) + [1] * (len(ids) - pad_start) for ids in batch_ids])
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        past_key_values = self.prefill(input_ids, attention_mask, pad_start) if pad_start else None
+        stopping_criteria = StoppingCriteriaList([ExtractionStoppingCriteria(
+            self.tokenizer, input_ids.shape[1], max_reactions, stop_repetition)])
+        if callback is not None:
+            stopping_criteria.append(Stream(callback_func=callback))
+
+        with torch.no_grad():
+            generation_output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                generation_config=generation_config,
+                return_dict_in_generate=True,
+                max_new_tokens=max_new_tokens,
+                stopping_criteria=stopping_criteria,
+            )
+        outputs = []
+        for ids, s in zip(batch_ids, generation_output.sequences):
+            s = torch.cat([s[:pad_start], s[pad_start + max_len - len(ids):]])
+            output = self.tokenizer.decode(s, skip_special_tokens=True)
+            output = output.split('<|assistant|>\n')[-1].strip()
+            if max_reactions is not None:
+                # rows that reached max_reactions keep generating until the whole batch stops
+                # on transformers before 4.39
+                output = truncate_blocks(output, max_reactions)
+            outputs.append(output)
+        return outputs
+
+    def generate_outputs(self, texts, generation_config, max_new_tokens, max_batch_tokens=None,
+                         max_reactions=None, stop_repetition=True):
+        # Raw model answer for every segment, in the order of texts
+        prompts = [self.build_prompt(text) for text in texts]
+        outputs = [None] * len(texts)
+        if self.result_cache is not None:
+            keys = [self.result_key(prompt, generation_config, max_new_tokens, max_reactions, stop_repetition)
+                    for prompt in prompts]
+            cached = self.result_cache.get_many(keys)
+            outputs = [cached.get(key) for key in keys]
+        todo = [i for i in range(len(texts)) if outputs[i] is None]
+        prompt_ids = [self.tokenizer(prompts[i])["input_ids"] for i in todo]
+        for batch in tqdm(self.length_batches([len(ids) for ids in prompt_ids], max_new_tokens, max_batch_tokens)):
+            batch_outputs = self.generate_batch([prompt_ids[j] for j in batch], generation_config, max_new_tokens,
+                                                max_reactions, stop_repetition)
+            for j, output in zip(batch, batch_outputs):
+                outputs[todo[j]] = output
+            if self.result_cache is not None:
+                self.result_cache.put_many((keys[todo[j]], output) for j, output in zip(batch, batch_outputs))
+        return outputs
+
+    def result_key(self, prompt, generation_config, max_new_tokens, max_reactions, stop_repetition):
+        # Everything that decides the raw answer: prompt (with the segment), models and decoding settings
+        generation = generation_config.to_dict()
+        generation.pop("transformers_version", None)
+        return cache_key(
+            prompt=prompt,
+            base_model=self.base_model,
+            lora=self.lora_path,
+            generation=generation,
+            max_new_tokens=max_new_tokens,
+            max_reactions=max_reactions,
+            stop_repetition=stop_repetition,
+        )
+
+    def make_generation_config(self, temperature, top_p, top_k, do_sample, **kwargs):
+        generation_config = GenerationConfig(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            # num_beams=num_beams,
+            do_sample=do_sample,
+            **kwargs,
+        )
+        if generation_config.pad_token_id is None:
+            # Llama has no padding token, pad with unk (id 0) as in training
+            generation_config.pad_token_id = 0
+        return generation_config
+
+    def answer_reactions(self, output):
+        # Reactions of a raw answer, none if the model found no complete reaction
+        if 'no complete' in output.lower():
+            return []
+        return self.get_structured_reactions(output)
+
     def extract(
         self,
         texts,
@@ -101,45 +418,98 @@ class ReactionExtractor:
         # num_beams=4,
         do_sample=True,
         max_new_tokens=1024,
+        max_batch_tokens=None,
+        max_reactions=None,
+        stop_repetition=True,
         **kwargs
     ):
-        system_prompt = "<|system|>\nYou are a helpful assistant in extracting all the chemical reactions from the text provided by the user.\n\n"
-        
-        generation_config = GenerationConfig(
-            temperature=temperature,
-            top_p=top_p,
-            top_k=top_k,
-            # num_beams=num_beams,
-            do_sample=do_sample,
-            **kwargs,
-        )
+        """
+        max_batch_tokens: decode segments of similar length together, in batches of at most
+            this many padded tokens (prompt and new tokens); None decodes one segment at a time
+        max_reactions: stop an answer after this many reaction blocks
+        stop_repetition: stop an answer stuck repeating itself, see ExtractionStoppingCriteria
+        kwargs: further GenerationConfig fields, e.g. output_scores=True to keep the scores of every step
+        """
+        generation_config = self.make_generation_config(temperature, top_p, top_k, do_sample, **kwargs)
 
         if isinstance(texts, str):
             texts = [texts]
-        
-        outputs = []
-        for input in tqdm(texts):
-            prompt = system_prompt + "<|user|>\n" + input.strip() + "\n\n<|assistant|>\n"
-            
-            inputs = self.tokenizer(prompt, return_tensors="pt")
-            input_ids = inputs["input_ids"].to(self.device)
 
-            with torch.no_grad():
-                generation_output = self.model.generate(
-                    input_ids=input_ids,
-                    generation_config=generation_config,
-                    return_dict_in_generate=True,
-                    output_scores=True,
-                    max_new_tokens=max_new_tokens,
-                )
-            s = generation_output.sequences[0]
-            output = self.tokenizer.decode(s, skip_special_tokens=True)
-            output = output.split('<|assistant|>\n')[-1].strip()
-            if 'no complete' not in output.lower():
-                cur_result = {}
-                cur_result['text'] = input.strip()
-                cur_result['reactions'] = self.get_structured_reactions(output)
-                if len(cur_result['reactions']) > 0:
-                    outputs.append(cur_result)
+        outputs = []
+        raw_outputs = self.generate_outputs(texts, generation_config, max_new_tokens, max_batch_tokens,
+                                            max_reactions, stop_repetition)
+        for input, output in zip(texts, raw_outputs):
+            cur_result = {}
+            cur_result['text'] = input.strip()
+            cur_result['reactions'] = self.answer_reactions(output)
+            if len(cur_result['reactions']) > 0:
+                outputs.append(cur_result)
         return outputs
 
+    def extract_iter(
+        self,
+        texts,
+        temperature=0.1,
+        top_p=0.75,
+        top_k=40,
+        do_sample=True,
+        max_new_tokens=1024,
+        max_reactions=None,
+        stop_repetition=True,
+        **kwargs
+    ):
+        """
+        Streaming version of extract(), segments are decoded one at a time. Yields
+            {'type': 'reaction', 'index': i, 'text': segment, 'reaction': dict}
+                as soon as a reaction block of segment i is complete, and
+            {'type': 'segment', 'index': i, 'text': segment, 'reactions': list}
+                when segment i is finished.
+        The segment event is final: its reactions are what extract() returns for the segment,
+        an empty list if extract() drops it.
+        """
+        generation_config = self.make_generation_config(temperature, top_p, top_k, do_sample, **kwargs)
+
+        if isinstance(texts, str):
+            texts = [texts]
+
+        for index, input in enumerate(texts):
+            prompt = self.build_prompt(input)
+            event = {'index': index, 'text': input.strip()}
+            output = None
+            if self.result_cache is not None:
+                key = self.result_key(prompt, generation_config, max_new_tokens, max_reactions, stop_repetition)
+                output = self.result_cache.get_many([key]).get(key)
+            emitted = 0
+            if output is None:
+                prompt_ids = self.tokenizer(prompt)["input_ids"]
+                answers = []
+
+                def generate(callback):
+                    answers.extend(self.generate_batch([prompt_ids], generation_config, max_new_tokens,
+                                                       max_reactions, stop_repetition, callback=callback))
+
+                tracker = BlockTracker(self.tokenizer)
+                with Iteratorize(generate) as tokens:
+                    for ids in tokens:
+                        blocks = tracker.update(ids[len(prompt_ids):])
+                        if tracker.no_complete:
+                            continue
+                        if max_reactions is not None:
+                            blocks = blocks[:max(0, max_reactions - emitted)]
+                        for block in blocks:
+                            for reaction in self.get_structured_reactions(block):
+                                yield dict(event, type='reaction', reaction=reaction)
+                        emitted += len(blocks)
+                if not answers:
+                    raise RuntimeError("generation failed for segment %d" % index)
+                output = answers[0]
+                if self.result_cache is not None:
+                    self.result_cache.put_many([(key, output)])
+            reactions = self.answer_reactions(output)
+            if reactions:
+                # the last block has no blank line after it
+                blocks = [block for block in output.split("\n\n") if block.strip()]
+                for block in blocks[emitted:]:
+                    for reaction in self.get_structured_reactions(block):
+                        yield dict(event, type='reaction', reaction=reaction)
+            yield dict(event, type='segment', reactions=reactions)
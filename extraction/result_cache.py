@@ -0,0 +1,62 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def cache_key(**fields):
+    """
+    sha256 of the json encoding of fields (segment, prompt, models, generation settings)
+    """
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite table of raw model answers, keyed by cache_key.
+    Answers are stored before any post-processing, so get_structured_reactions and
+    excluded_phrases can change without generating again.
+    """
+    def __init__(self, path="extraction/cache.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outputs (key TEXT PRIMARY KEY, output TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_many(self, keys):
+        """
+        return dict key -> stored answer for the keys found
+        """
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        # stay below SQLite's limit on query parameters
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = self.connection.execute(
+                "SELECT key, output FROM outputs WHERE key IN (%s)" % ",".join("?" * len(chunk)), chunk
+            )
+            found.update(rows)
+        self.stats["hits"] += sum(1 for key in keys if key in found)
+        self.stats["misses"] += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        items: iterable of (key, answer)
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO outputs (key, output, created) VALUES (?, ?, ?)",
+                [(key, output, now) for key, output in items],
+            )
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from ..generalParser import parse
+from ..helpers import pdfToXmlHelper, xmlToJsonHelper
+from ..postprocess import cleanData, concat_paragraphs
+from . import syntheticXml
+
+benchmarkPath = os.path.dirname(os.path.abspath(__file__))
+baselinePath = benchmarkPath + "/baseline.json"
+documentName = "benchmark_synthetic"
+
+# every timed run of a stage is looped until it takes at least this long, so fast stages are not lost in timer noise
+minSeconds = 0.05
+# document used for the committed baseline
+defaultParams = {"pages": 40, "columns": 2, "linesPerPage": 60, "wordsPerLine": 10, "ligatureDensity": 0.02,
+                 "invalidDensity": 0.001, "captionRate": 0.3, "seed": 0}
+
+
+def measure(func, repeat):
+    # run func repeat times, return (best wall time per call in seconds, peak traced memory in bytes)
+    # calls faster than minSeconds are looped until a timed run takes at least minSeconds
+    # progress messages printed by the stages are discarded
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func()
+        loops = max(1, math.ceil(minSeconds / max(time.perf_counter() - start, 1e-9)))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            best = min(best, (time.perf_counter() - start) / loops)
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def calibrationWorkload():
+    # fixed pure-Python work (string building, stdlib XML parsing, float conversion) that does not depend on
+    # the code under test, so its time only reflects the speed of the machine
+    document = "<Page>" + "".join('<Line BBOX="%d.5 %d 3 4"><Word>w%d</Word></Line>' % (i % 97, i % 13, i)
+                                  for i in range(20000)) + "</Page>"
+    root = ET.fromstring(document)
+    starts = sorted(float(lineXml.attrib["BBOX"].split(" ")[0]) for lineXml in root.iter("Line"))
+    return len(" ".join(wordXml.text for wordXml in root.iter("Word")).split()) + len(starts)
+
+
+def runBenchmark(params=defaultParams, repeat=3):
+    # time every Stage I step on a synthetic document,
+    # return {stage: {seconds, relative, pagesPerSecond, linesPerSecond, peakMB}}
+    # relative is the time of the stage divided by the time of calibrationWorkload
+    workDirPath = tempfile.mkdtemp(prefix="pdf2text_benchmark_")
+    try:
+        sourcePath = os.path.join(workDirPath, "source.xml")
+        xmlPath = os.path.join(workDirPath, documentName + ".xml")
+        lineCount = syntheticXml.writeXml(sourcePath, **params)
+
+        def freshCopy():
+            shutil.copyfile(sourcePath, xmlPath)
+
+        def preParse():
+            freshCopy()
+            pdfToXmlHelper.preParseXML(xmlPath)
+
+        # every other stage runs on the sanitized document
+        preParse()
+        root = ET.parse(xmlPath).getroot()
+        rawData = parse(xmlPath, persist=False)
+
+        stages = {
+            "preParseXML": preParse,
+            "parse": lambda: parse(xmlPath, persist=False),
+            "parseStreaming": lambda: parse(sourcePath, streaming=True, persist=False),
+            "findOffset": lambda: xmlToJsonHelper.findOffset(root),
+            "cleanData": lambda: cleanData(dict(rawData), semantic=False),
+            "concat_paragraphs": lambda: concat_paragraphs(rawData["contents"]),
+        }
+        calibrationSeconds = measure(calibrationWorkload, repeat)[0]
+        report = {}
+        for stage, func in stages.items():
+            seconds, peak = measure(func, repeat)
+            report[stage] = {
+                "seconds": round(seconds, 7),
+                "relative": round(seconds / calibrationSeconds, 7),
+                "pagesPerSecond": round(params["pages"] / seconds, 1),
+                "linesPerSecond": round(lineCount / seconds, 1),
+                "peakMB": round(peak / 1024 ** 2, 2),
+            }
+        return report
+    finally:
+        shutil.rmtree(workDirPath)
+
+
+def compareToBaseline(report, baseline, tolerance):
+    # return the stages whose throughput relative to calibrationWorkload dropped by more than tolerance (a fraction)
+    # compared to the baseline; absolute times depend on the machine and are not compared
+    regressions = []
+    for stage, result in report.items():
+        if stage not in baseline:
+            continue
+        expected = baseline[stage]["relative"]
+        if result["relative"] > expected / (1 - tolerance):
+            regressions.append((stage, expected, result["relative"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Stage I (XML to JSON) on synthetic SymbolScraper output.")
+    parser.add_argument("--pages", type=int, default=defaultParams["pages"])
+    parser.add_argument("--columns", type=int, default=defaultParams["columns"])
+    parser.add_argument("--lines-per-page", type=int, default=defaultParams["linesPerPage"])
+    parser.add_argument("--ligature-density", type=float, default=defaultParams["ligatureDensity"])
+    parser.add_argument("--caption-rate", type=float, default=defaultParams["captionRate"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed drop of the throughput relative to the calibration workload against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    params = dict(defaultParams, pages=args.pages, columns=args.columns, linesPerPage=args.lines_per_page,
+                  ligatureDensity=args.ligature_density, captionRate=args.caption_rate)
+    report = runBenchmark(params, args.repeat)
+    print("%-18s %10s %10s %12s %12s %8s" % ("stage", "seconds", "relative", "pages/s", "lines/s", "peak MB"))
+    for stage, result in report.items():
+        print("%-18s %10.6f %10.4f %12.1f %12.1f %8.2f" % (stage, result["seconds"], result["relative"],
+                                                           result["pagesPerSecond"], result["linesPerSecond"],
+                                                           result["peakMB"]))
+
+    if args.update_baseline:
+        with open(baselinePath, "w") as file:
+            json.dump({"params": params, "stages": report}, file, indent=4)
+        print("Baseline written to:", baselinePath)
+        return 0
+    if not os.path.exists(baselinePath):
+        return 0
+    with open(baselinePath, "r") as file:
+        baseline = json.load(file)
+    if baseline["params"] != params:
+        print("Parameters differ from the baseline, skipping comparison")
+        return 0
+    regressions = compareToBaseline(report, baseline["stages"], args.tolerance)
+    for stage, expected, actual in regressions:
+        print("Regression: %s takes %.4f times the calibration workload (baseline %.4f)" % (stage, actual, expected))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import random
+
+from .. import config
+
+# vocabulary of the synthetic body text, the last words contain ligatures SymbolScraper emits as single glyphs
+words = ["the", "reaction", "mixture", "was", "stirred", "at", "room", "temperature", "for", "h", "and", "then",
+         "filtered", "product", "yield", "solvent", "acid", "copper", "acetate", "of", "in", "to", "with", "catalyst",
+         "heated", "under", "argon", "washed", "dried", "over", "concen-", "trated", "purified", "by", "column"]
+ligatureWords = ["ﬁltered", "ﬂask", "eﬀect", "suﬃcient", "−"]
+# characters SymbolScraper writes unescaped, fixed by preParseXML
+invalidChars = ["&", "<", ">", chr(1), chr(31)]
+
+
+def charXml(char, x, y):
+    return '<Char BBOX="%.2f %.2f %.2f %.2f" RGB="[0.0]">%s</Char>' % (x, y, x + 5, y + 9, char)
+
+
+def lineXml(lineId, text, x, y, width):
+    # a Line element with one Word per token and one Char per character
+    parts = ['<Line id="%d" BBOX="%.2f %.2f %.2f %.2f">' % (lineId, x, y, x + width, y + 9)]
+    charX = x
+    for token in text.split(" "):
+        parts.append('<Word BBOX="%.2f %.2f %.2f %.2f">' % (charX, y, charX + 5 * len(token), y + 9))
+        for char in token:
+            parts.append(charXml(char, charX, y))
+            charX += 5
+        parts.append("</Word>")
+        charX += 5
+    parts.append("</Line>")
+    return "\n".join(parts)
+
+
+def generateXml(pages=10, columns=2, linesPerPage=50, wordsPerLine=10, ligatureDensity=0.02,
+                invalidDensity=0.001, captionRate=0.3, paragraphLines=8, seed=0):
+    # given the layout parameters, return the text of a SymbolScraper-format xml document
+    # columns are filled top to bottom; paragraphs start indented by config.tabWidth;
+    # with probability captionRate a page ends with a figure caption followed by figure labels
+    rng = random.Random(seed)
+    columnWidth = 500 / columns
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>', "<Document>"]
+    lineId = 0
+    for pageId in range(pages):
+        parts.append('<Page id="%d" BBOX="0 0 612 792">' % pageId)
+        linesPerColumn = linesPerPage // columns
+        captionLine = rng.randrange(linesPerColumn) if rng.random() < captionRate else -1
+        for column in range(columns):
+            x0 = 56 + column * (columnWidth + 20)
+            for row in range(linesPerColumn):
+                y = 60 + row * config.lineHeight
+                if column == columns - 1 and row == captionLine:
+                    text = "Figure %d. Synthesis of the %s complex" % (pageId + 1, rng.choice(words))
+                    parts.append(lineXml(lineId, text, x0, y, columnWidth))
+                    lineId += 1
+                    break
+                tokens = []
+                for _ in range(wordsPerLine):
+                    if rng.random() < ligatureDensity:
+                        tokens.append(rng.choice(ligatureWords))
+                    elif rng.random() < invalidDensity:
+                        tokens.append(rng.choice(invalidChars))
+                    else:
+                        tokens.append(rng.choice(words))
+                startsParagraph = row % paragraphLines == 0
+                x = x0 + config.tabWidth if startsParagraph else x0
+                if row % paragraphLines == paragraphLines - 1:
+                    tokens[-1] += "."
+                parts.append(lineXml(lineId, " ".join(tokens), x, y, columnWidth - (x - x0)))
+                lineId += 1
+        parts.append("</Page>")
+    parts.append("</Document>")
+    return "\n".join(parts) + "\n"
+
+
+def writeXml(path, **params):
+    # write a synthetic document to path, return the number of Line elements
+    xml = generateXml(**params)
+    with open(path, "w") as file:
+        file.write(xml)
+    return xml.count("<Line ")
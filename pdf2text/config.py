@@ -2,3 +2,11 @@ defaultDir = ""  # default directory to store the PDF to be parsed
 tabWidth = 10
 lineHeight = 12
 threshhold_value = 0.12
+semanticCleaning = True  # filter noise paragraphs with MPNet embeddings; False skips the model entirely
+mpnetBackend = "torch"  # "int8" runs MPNet with dynamically quantized linear layers on CPU
+cacheDir = "cache"  # directory (inside pdf2text/) holding cached intermediate and final results
+cacheMaxSize = 5 * 1024 ** 3  # maximum size of the result cache in bytes, least recently used entries are evicted
+scraperWorkers = 4  # number of SymbolScraper processes running at the same time when parsing a folder
+scraperBatchSize = 8  # number of PDFs converted by one SymbolScraper invocation (one JVM start)
+scraperTimeout = 300  # seconds allowed per PDF before a SymbolScraper invocation is killed
+parseProcesses = 4  # number of processes parsing PDFs in parallel (parseFolderParallel)
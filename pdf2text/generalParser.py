@@ -1,19 +1,65 @@
 import getopt
 import json
 import os
+import shutil
 import sys
+import tempfile
+import time
 import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
 
 from . import config
-from .helpers import fileIOHelper, logHelper, pdfToXmlHelper, xmlToJsonHelper
-from .postprocess import cleanJson
+from .helpers import cacheHelper, fileIOHelper, logHelper, manifestHelper, pdfToXmlHelper, symbolScraperHelper, xmlToJsonHelper
+from .postprocess import cleanData, cleanJson
 
 projectPath = os.path.dirname(os.path.abspath(__file__))
+resultCache = None
+# results of the in-memory mode are persisted by a single background thread, off the critical path
+backgroundWriter = ThreadPoolExecutor(max_workers=1)
+pendingWrites = []
 
 
-def parseFile(pdfPath: str, logging=False):
+def getResultCache():
+    # the result cache shared by every parseFile call of this process
+    global resultCache
+    if resultCache is None:
+        resultCache = cacheHelper.ResultCache()
+    return resultCache
+
+
+def writeInBackground(func, *args):
+    # run a persistence function on the background writer thread
+    # a failed write is reported as soon as it fails, since callers may never call waitForWrites
+    pendingWrites[:] = [future for future in pendingWrites if not future.done()]
+    future = backgroundWriter.submit(func, *args)
+    future.add_done_callback(lambda done: reportWriteError(done, func, args[0] if args else None))
+    pendingWrites.append(future)
+
+
+def reportWriteError(future, func, target):
+    # print the error of a failed background write
+    if not future.cancelled() and future.exception() is not None:
+        print("Error: background %s(%s) failed:" % (func.__name__, target), repr(future.exception()), file=sys.stderr)
+
+
+def waitForWrites():
+    # block until every background write has finished, re-raising the first error
+    while pendingWrites:
+        pendingWrites.pop(0).result()
+
+
+def parseFile(pdfPath: str, logging=False, streaming=False, semanticCleaning=config.semanticCleaning, inMemory=False,
+              xmlSource=None):
     # given a path to a pdf file, parse the pdf file and output a json file
     # both symbol scraper and xml parser are run
+    # streaming: parse the xml page by page instead of loading the whole tree (for very large PDFs)
+    # semanticCleaning: False skips the MPNet noise filter (and loading the model)
+    # inMemory: pass the parsed object between stages instead of re-reading json files;
+    #           the raw json only goes to the cache and results/ is written in the background
+    # xmlSource: xml SymbolScraper already produced for this pdf (see convertPDFs), moved into place
+    #            instead of looking up the cache or running SymbolScraper again
 
     # check if pdf file exists
     if not os.path.exists(pdfPath):
@@ -24,53 +70,52 @@ def parseFile(pdfPath: str, logging=False):
     xmlPath = projectPath + "/xmlFiles/" + filename + ".xml"
     rawJsonPath = projectPath + "/parsed_raw/" + filename + ".json"
     cleanJsonPath = projectPath + "/results/" + filename + ".json"
-    pdfDirPath = os.path.dirname(pdfPath)
     xmlDirPath = os.path.dirname(xmlPath)
 
-    # create xml dir if not exist
-    if not os.path.exists(xmlDirPath):
-        os.mkdir(xmlDirPath)
+    # create output dirs if not exist
+    for dirPath in (xmlDirPath, os.path.dirname(rawJsonPath), os.path.dirname(cleanJsonPath)):
+        os.makedirs(dirPath, exist_ok=True)
 
-    # step 1: parse pdf into xml using Symbol Scraper
-    print("Step 1: Parse PDF into XML using Symbol Scraper")
-    # don't run SymbolScraper if xml already parsed
-    if os.path.exists(xmlPath):
-        print("XML file already exists:", xmlPath)
-    else:
-        print("Parsing", pdfPath)
-        suppressSymbolScraperOutput = True
-        outputOption = " > /dev/null" if suppressSymbolScraperOutput else ""
-        os.system(projectPath + "/SymbolScraper/bin/sscraper " + pdfPath + " " + xmlDirPath + outputOption)
-        if not os.path.exists(xmlPath):
-            print("Error: SymbolScraper failed to parse", pdfPath)
-            logHelper.errorLog(pdfPath)
-            return -1
-        print("XML file written to:", xmlPath)
+    # results are cached by the content of the pdf plus the config and code version of every stage,
+    # so renamed or same-named pdfs and changed settings never get stale results
+    cache = getResultCache()
+    xmlKey, rawJsonKey, cleanJsonKey = stageKeys(pdfPath, semanticCleaning)
 
-    # step 2: parse xml into raw json
-    print("Step 2: Parse XML into raw JSON")
-    # don't parse xml if json already exists
-    if os.path.exists(rawJsonPath):
-        print("JSON file already exists:", rawJsonPath)
-    else:
-        parseExitCode = parse(xmlPath)
-        if parseExitCode == -1:
-            print("Error: Parse XML failed, skipping", pdfPath)
+    if inMemory:
+        data = parseInMemory(pdfPath, xmlPath, cleanJsonPath, xmlKey, rawJsonKey, cleanJsonKey, streaming, semanticCleaning,
+                             xmlSource)
+        if data == -1:
             return -1
+        print("Finished parsing", pdfPath, "\n")
+        if logging:
+            logHelper.successLog(pdfPath)
+        return data
 
-    # step 3: clean json
-    print("Step 3: Clean JSON file")
-    # don't clean json if clean json already exists
-    if os.path.exists(cleanJsonPath):
-        print("Clean JSON file already exists:", cleanJsonPath)
+    # the latest cached stage is looked up first, so a cached result never needs an earlier stage
+    # (e.g. SymbolScraper for an xml evicted from the cache)
+    if cache.fetch(cleanJsonKey, ".json", cleanJsonPath):
+        print("Clean JSON file found in cache:", cleanJsonPath)
     else:
-        cleanJson(rawJsonPath)
+        # don't run SymbolScraper and parse xml if raw json is cached
+        if cache.fetch(rawJsonKey, ".json", rawJsonPath):
+            print("JSON file found in cache:", rawJsonPath)
+        else:
+            # step 1: parse pdf into xml using Symbol Scraper
+            if not convertStep(pdfPath, xmlPath, xmlKey, xmlSource):
+                return -1
+
+            # step 2: parse xml into raw json
+            print("Step 2: Parse XML into raw JSON")
+            parseExitCode = parse(xmlPath, streaming=streaming)
+            if parseExitCode == -1:
+                print("Error: Parse XML failed, skipping", pdfPath)
+                return -1
+            cache.store(rawJsonKey, ".json", rawJsonPath)
 
-    # clean up useless .md files created by SymbolScraper
-    print('pdfDirPath', pdfDirPath)
-    for file in os.listdir(pdfDirPath):
-        if file.endswith(".md") and file != "README.md":
-            os.remove(pdfDirPath + "/" + file)
+        # step 3: clean json
+        print("Step 3: Clean JSON file")
+        cleanJson(rawJsonPath, semantic=semanticCleaning)
+        cache.store(cleanJsonKey, ".json", cleanJsonPath)
 
     print("Finished parsing", pdfPath, "\n")
     # write to the end of log.txt with timestamp
@@ -82,77 +127,321 @@ def parseFile(pdfPath: str, logging=False):
         return json.load(f)
 
 
-def parseFolder(folderPath: str, logging=False):
+def stageKeys(pdfPath, semanticCleaning=config.semanticCleaning):
+    # cache keys of the xml, raw json and clean json of a pdf
+
+    xmlKey = cacheHelper.stageKey("xml", cacheHelper.hashFile(pdfPath))
+    rawJsonKey = cacheHelper.stageKey("rawJson", xmlKey, tabWidth=config.tabWidth, lineHeight=config.lineHeight)
+    cleanJsonKey = cacheHelper.stageKey("cleanJson", rawJsonKey, threshold=config.threshhold_value, semantic=semanticCleaning,
+                                        backend=config.mpnetBackend)
+    return xmlKey, rawJsonKey, cleanJsonKey
+
+
+def convertStep(pdfPath, xmlPath, xmlKey, xmlSource=None):
+    # step 1 of parseFile: make sure xmlPath holds the SymbolScraper xml of the pdf, return False on failure
+
+    cache = getResultCache()
+    print("Step 1: Parse PDF into XML using Symbol Scraper")
+    if xmlSource is not None:
+        shutil.move(xmlSource, xmlPath)
+        cache.store(xmlKey, ".xml", xmlPath)
+        print("XML file written to:", xmlPath)
+        return True
+    # don't run SymbolScraper if xml is cached
+    if cache.fetch(xmlKey, ".xml", xmlPath):
+        print("XML file found in cache:", xmlPath)
+        return True
+    print("Parsing", pdfPath)
+    if not symbolScraperHelper.convertFile(pdfPath, xmlPath):
+        print("Error: SymbolScraper failed to parse", pdfPath)
+        logHelper.errorLog(pdfPath)
+        return False
+    cache.store(xmlKey, ".xml", xmlPath)
+    print("XML file written to:", xmlPath)
+    return True
+
+
+def parseInMemory(pdfPath, xmlPath, cleanJsonPath, xmlKey, rawJsonKey, cleanJsonKey, streaming, semanticCleaning, xmlSource=None):
+    # steps 1 to 3 of parseFile without json round-trips, return the clean json object
+
+    cache = getResultCache()
+    filename = os.path.basename(cleanJsonPath)[: -len(".json")]
+    # a cached clean result needs neither SymbolScraper nor the xml, but is still written to results/
+    data = cache.loadJson(cleanJsonKey)
+    if data is not None:
+        print("Clean JSON found in cache")
+        writeInBackground(fileIOHelper.outputCleanJsonFile, filename, data)
+        return copyResult(data)
+
+    rawData = cache.loadJson(rawJsonKey)
+    if rawData is None:
+        if not convertStep(pdfPath, xmlPath, xmlKey, xmlSource):
+            return -1
+        print("Step 2: Parse XML into raw JSON")
+        rawData = parse(xmlPath, streaming=streaming, persist=False)
+        if rawData == -1:
+            print("Error: Parse XML failed, skipping", pdfPath)
+            return -1
+        writeInBackground(cache.storeJson, rawJsonKey, rawData)
+
+    print("Step 3: Clean JSON")
+    data = cleanData(dict(rawData), semantic=semanticCleaning)
+    writeInBackground(fileIOHelper.outputCleanJsonFile, filename, data)
+    writeInBackground(cache.storeJson, cleanJsonKey, data)
+    return copyResult(data)
+
+
+def copyResult(data):
+    # the background writer keeps data, so callers get their own copy to modify
+    result = dict(data)
+    result["contents"] = list(data["contents"])
+    return result
+
+
+def parseFolder(folderPath: str, logging=False, streaming=False, workers=config.scraperWorkers):
     # given a path to a folder, recursively parse all pdf files in it
+    # pdfs with a cached result are parsed first; SymbolScraper runs for the others on a pool of workers,
+    # and each pdf is parsed from its fresh xml as soon as its batch is converted
+
+    pdfPaths = collectPDFs(folderPath)
+    uncachedPaths = uncachedPDFs(pdfPaths)
+    uncachedSet = set(uncachedPaths)
+    for pdfPath in pdfPaths:
+        if pdfPath not in uncachedSet:
+            parseFile(pdfPath, logging=logging, streaming=streaming)
+    with tempfile.TemporaryDirectory(prefix="xml_") as xmlDirPath:
+        for pdfPath, xmlSource in convertPDFs(uncachedPaths, xmlDirPath, workers=workers):
+            if xmlSource is None:
+                print("Error: SymbolScraper failed to parse", pdfPath)
+                logHelper.errorLog(pdfPath)
+                continue
+            parseFile(pdfPath, logging=logging, streaming=streaming, xmlSource=xmlSource)
+    cache = getResultCache()
+    print("Result cache: %d hits, %d misses, %d evictions" % (cache.stats["hits"], cache.stats["misses"], cache.stats["evictions"]))
 
+
+def parseFolderParallel(folderPath: str, processes=config.parseProcesses, workers=config.scraperWorkers,
+                        logging=False, streaming=False, semanticCleaning=config.semanticCleaning, inMemory=False,
+                        manifestPath=manifestHelper.manifestPath, retryFailed=False):
+    # given a path to a folder, parse all pdf files in it on a pool of processes
+    # the input tree is never modified; the status and duration of every pdf is recorded in a manifest,
+    # so an interrupted run resumes with the pdfs that are not done yet
+
+    manifest = manifestHelper.loadManifest(manifestPath)
+    pdfPaths = [pdfPath for pdfPath in listPDFs(folderPath) if not manifestHelper.isDone(manifest, pdfPath, retryFailed)]
+    print("Parsing", len(pdfPaths), "PDF files with", processes, "processes")
+    uncachedPaths = uncachedPDFs(pdfPaths, semanticCleaning)
+
+    # pdfs sharing a basename share their output files, so they run one after another in the same task
+    tasks = defaultdict(list)
+    for pdfPath in pdfPaths:
+        tasks[os.path.basename(pdfPath)].append(pdfPath)
+    # xml SymbolScraper produced for every pdf of a task so far (None if cached or failed);
+    # a task is submitted once all its pdfs are converted, so parsing overlaps with SymbolScraper
+    xmlSources = dict.fromkeys(set(pdfPaths) - set(uncachedPaths))
+    failedPaths = set()
+    futures = set()
+
+    def recordTask(future):
+        # put the records of a finished task into the manifest
+        futures.remove(future)
+        for pdfPath, record in future.result():
+            manifest[pdfPath] = record
+        manifestHelper.saveManifest(manifest, manifestPath)
+
+    def submitReady(executor, name):
+        # submit the task of a basename once none of its pdfs is waiting for SymbolScraper
+        taskPaths = tasks[name]
+        if all(pdfPath in xmlSources or pdfPath in failedPaths for pdfPath in taskPaths):
+            jobs = [(pdfPath, xmlSources[pdfPath]) for pdfPath in taskPaths if pdfPath not in failedPaths]
+            if jobs:
+                futures.add(executor.submit(parseFileTask, jobs, logging, streaming, semanticCleaning, inMemory,
+                                            cacheHelper.knownHashes(taskPaths)))
+
+    with tempfile.TemporaryDirectory(prefix="xml_") as xmlDirPath, \
+            ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn")) as executor:
+        for name in tasks:
+            submitReady(executor, name)
+        for pdfPath, xmlSource in convertPDFs(uncachedPaths, xmlDirPath, workers=workers):
+            if xmlSource is None:
+                print("Error: SymbolScraper failed to parse", pdfPath)
+                if logging:
+                    logHelper.errorLog(pdfPath)
+                failedPaths.add(pdfPath)
+                manifest[pdfPath] = {"status": "failed", "signature": manifestHelper.fileSignature(pdfPath),
+                                     "duration": 0.0, "error": "SymbolScraper failed"}
+                manifestHelper.saveManifest(manifest, manifestPath)
+            else:
+                xmlSources[pdfPath] = xmlSource
+            submitReady(executor, os.path.basename(pdfPath))
+            for future in [future for future in futures if future.done()]:
+                recordTask(future)
+        for future in as_completed(list(futures)):
+            recordTask(future)
+
+    statuses = [manifest[pdfPath]["status"] for pdfPath in pdfPaths]
+    print("Finished parsing folder:", statuses.count("done"), "done,", statuses.count("failed"), "failed")
+    return manifest
+
+
+def parseFileTask(jobs, logging=False, streaming=False, semanticCleaning=config.semanticCleaning, inMemory=False,
+                  fileHashes=None):
+    # run parseFile on each (pdfPath, xmlSource) job in a worker process, return a manifest record for each of them
+    # fileHashes: digests of the pdfs already computed by the parent process (see cacheHelper.knownHashes)
+
+    cacheHelper.fileHashes.update(fileHashes or {})
+    records = []
+    for pdfPath, xmlSource in jobs:
+        start = time.time()
+        error = None
+        try:
+            if parseFile(pdfPath, logging=logging, streaming=streaming, semanticCleaning=semanticCleaning, inMemory=inMemory,
+                         xmlSource=xmlSource) == -1:
+                error = "parseFile failed"
+            waitForWrites()
+        except Exception as e:
+            error = repr(e)
+        record = {"status": "failed" if error else "done", "signature": manifestHelper.fileSignature(pdfPath),
+                  "duration": round(time.time() - start, 3), "error": error}
+        records.append((pdfPath, record))
+    return records
+
+
+def listPDFs(folderPath: str):
+    # given a path to a folder, recursively list the absolute paths of all pdf files in it without renaming anything
+
+    pdfPaths = []
+    for dirPath, dirNames, fileNames in os.walk(folderPath):
+        dirNames.sort()
+        pdfPaths.extend(os.path.abspath(os.path.join(dirPath, fileName)) for fileName in sorted(fileNames) if fileName.endswith(".pdf"))
+    return pdfPaths
+
+
+def collectPDFs(folderPath: str):
+    # given a path to a folder, recursively list all pdf files in it (renaming them to valid paths)
+
+    pdfPaths = []
     for item in sorted(os.listdir(folderPath)):
         itemPath = os.path.join(folderPath, item)
         if itemPath.endswith(".pdf"):
-            validPath = fileIOHelper.validateFilename(itemPath)
-            parseFile(validPath, logging=logging)
+            pdfPaths.append(fileIOHelper.validateFilename(itemPath))
         elif os.path.isdir(itemPath):
             validPath = fileIOHelper.validateFilename(itemPath)
-            parseFolder(validPath, logging=logging)
+            pdfPaths.extend(collectPDFs(validPath))
+    return pdfPaths
 
 
-def parse(inputXml: str, logging=False):
+def uncachedPDFs(pdfPaths, semanticCleaning=config.semanticCleaning):
+    # return the list of pdfs that need SymbolScraper: neither their xml nor a later stage result is cached
+
+    cache = getResultCache()
+    uncachedPaths = []
+    for pdfPath in pdfPaths:
+        xmlKey, rawJsonKey, cleanJsonKey = stageKeys(pdfPath, semanticCleaning)
+        entryPaths = [cache.entryPath(xmlKey, ".xml"), cache.entryPath(rawJsonKey, ".json"), cache.entryPath(cleanJsonKey, ".json")]
+        if not any(os.path.exists(entryPath) for entryPath in entryPaths):
+            uncachedPaths.append(pdfPath)
+    return uncachedPaths
+
+
+def convertPDFs(pdfPaths, xmlDirPath, workers=config.scraperWorkers):
+    # run SymbolScraper on the pdfs on a pool of workers, writing the xml files into xmlDirPath
+    # yield (pdfPath, xmlPath) as soon as the batch of a pdf is done, xmlPath is None if the conversion failed;
+    # the xml is handed over directly rather than through the cache, which may evict it on a large corpus
+
+    if not pdfPaths:
+        return
+    print("Converting", len(pdfPaths), "PDF files with", workers, "SymbolScraper workers")
+    pool = symbolScraperHelper.SymbolScraperPool(workers=workers)
+    jobs = [(pdfPath, os.path.join(xmlDirPath, "%d.xml" % idx)) for idx, pdfPath in enumerate(pdfPaths)]
+    for results in pool.convertIter(jobs):
+        yield from results.items()
+
+
+def parse(inputXml: str, logging=False, streaming=False, persist=True):
     # given a path to a xml file, parse the xml file and output a json file
+    # return the parsed object; persist=False skips writing it to parsed_raw/
+    # in streaming mode the xml is sanitized on the fly and read in a single pass, one page at a time;
+    # only the text and boxes of the lines are kept, so the file is never rewritten and no element tree
+    # larger than a page is built
+
+    # text is collected in builders and joined once at the end, keeping assembly linear in document length
+    fullText = xmlToJsonHelper.TextBuilder()
+    contents = []
 
-    pdfToXmlHelper.preParseXML(inputXml)
     try:
-        tree = ET.parse(inputXml)  # improvement: change to argument based input
+        if streaming:
+            # the paragraph start positions depend on every line of the document,
+            # so the pages are read once and assembled after the whole file is seen
+            pages = [readPage(pageXml) for pageXml in pdfToXmlHelper.iterPages(inputXml)]
+            paragraphStart = xmlToJsonHelper.findOffsetFromStarts(lineTable[:, 0] for _, lineTable in pages)
+            for lineContents, lineTable in pages:
+                parsePage(lineContents, lineTable, paragraphStart, fullText, contents)
+        else:
+            pdfToXmlHelper.preParseXML(inputXml)
+            tree = ET.parse(inputXml)  # improvement: change to argument based input
+            root = tree.getroot()
+            paragraphStart = xmlToJsonHelper.findOffset(root)
+            for pageXml in root.iter("Page"):
+                parsePage(*readPage(pageXml), paragraphStart, fullText, contents)
     except ET.ParseError:
         print("Error: Parse XML failed, skipping", inputXml)
         if logging:
             logHelper.errorLog(inputXml)
         return -1
-    root = tree.getroot()
 
     output = {}
-    output["fullText"] = ""
-    output["contents"] = []
-
-    paragraphStart = xmlToJsonHelper.findOffset(root)
-
-    for pageXml in root.iter("Page"):
-        prevLineBBOX = None
-        for lineXml in pageXml.iter("Line"):
-            # building line content
-            lineContent = ""
-            lineXMLBBOX = lineXml.attrib["BBOX"]
-            for wordXml in lineXml.iter("Word"):
-                word = xmlToJsonHelper.buildWord(wordXml)
-                lineContent = xmlToJsonHelper.updateText(lineContent, word)
-            lineContent = lineContent.strip()
-
-            # if the line is a graph, skip the rest of the page
-            # fullText will not have the rest of page either
-            if xmlToJsonHelper.checkEndOfPage(lineContent) and xmlToJsonHelper.checkNewParagraph(lineXMLBBOX, prevLineBBOX, paragraphStart):
-                break
-            # update outputs
-            output["fullText"] = xmlToJsonHelper.updateText(output["fullText"], lineContent)
-            if xmlToJsonHelper.checkNewParagraph(lineXMLBBOX, prevLineBBOX, paragraphStart):
-                output["contents"].append(lineContent)
-            else:
-                output["contents"][-1] = xmlToJsonHelper.updateText(output["contents"][-1], lineContent)
-            # update prevLineBBOX
-            if xmlToJsonHelper.checkSameLine(lineXMLBBOX, prevLineBBOX):
-                prevLineBBOX = xmlToJsonHelper.combineLines(lineXMLBBOX, prevLineBBOX)
-            else:
-                prevLineBBOX = lineXMLBBOX
+    output["fullText"] = fullText.build()
+    output["contents"] = [paragraph.build() for paragraph in contents]
     # output raw json file
-    filename = os.path.basename(inputXml)[: -len(".xml")]
-    fileIOHelper.outputDirtyJsonFile(filename, output)
+    if persist:
+        filename = os.path.basename(inputXml)[: -len(".xml")]
+        fileIOHelper.outputDirtyJsonFile(filename, output)
+    return output
+
+
+def readPage(pageXml):
+    # given a page xml element, return the text of its lines and their BBOX table
+
+    lineContents = []
+    lineBBOXes = []
+    for lineXml in pageXml.iter("Line"):
+        # building line content
+        lineContent = xmlToJsonHelper.TextBuilder()
+        for wordXml in lineXml.iter("Word"):
+            lineContent.append(xmlToJsonHelper.buildWord(wordXml))
+        lineContents.append(lineContent.build().strip())
+        lineBBOXes.append(lineXml.attrib["BBOX"])
+    return lineContents, xmlToJsonHelper.parseBBOXes(lineBBOXes)
+
+
+def parsePage(lineContents, lineTable, paragraphStart, fullText, contents):
+    # given the lines of a page (see readPage), append them to the fullText builder and the paragraph builders in contents
+
+    newParagraphs = xmlToJsonHelper.findNewParagraphs(lineTable, paragraphStart)
+
+    for lineContent, newParagraph in zip(lineContents, newParagraphs):
+        # if the line is a graph, skip the rest of the page
+        # fullText will not have the rest of page either
+        if xmlToJsonHelper.checkEndOfPage(lineContent) and newParagraph:
+            break
+        # update outputs
+        fullText.append(lineContent)
+        if newParagraph:
+            contents.append(xmlToJsonHelper.TextBuilder(lineContent))
+        else:
+            contents[-1].append(lineContent)
 
 
 # main function
 if __name__ == "__main__":
     argv = sys.argv[1:]
     inputfile = ""
-    opts, args = getopt.getopt(argv, "hcli:")
+    opts, args = getopt.getopt(argv, "hclp:i:")
     for opt, arg in opts:
         if opt == "-h":
             print("[Usage]: python3 generalParser.py -i <inputPDF>")
+            print("[Usage]: python3 generalParser.py -p <processes>  (parse the default folder in parallel)")
             print("Result will be saved as a .json file in the results/ folder")
             sys.exit()
         elif opt == "-i":
@@ -164,6 +453,9 @@ if __name__ == "__main__":
             target_dir = os.path.join(projectPath, config.defaultDir)
             logHelper.logHeader()
             parseFolder(target_dir, logging=True)
+        elif opt == "-p":
+            target_dir = os.path.join(projectPath, config.defaultDir)
+            parseFolderParallel(target_dir, processes=int(arg))
     if not opts:
         target_dir = os.path.join(projectPath, config.defaultDir)
         parseFolder(target_dir)
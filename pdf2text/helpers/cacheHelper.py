@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+
+from .. import config
+
+projectPath = os.path.dirname(os.path.abspath(__file__)) + "/../"
+
+# bump the version of a stage whenever its code changes the output,
+# so that entries produced by older code are never served again
+stageVersions = {
+    "xml": 1,  # SymbolScraper conversion
+    "rawJson": 1,  # xml to raw json (parse)
+    "cleanJson": 1,  # semantic cleaning (cleanJson)
+}
+
+
+# eviction frees space down to this fraction of maxSize, so a full cache is not scanned again on every store
+evictionTarget = 0.9
+
+# sha256 digests already computed by this process, by fileStamp
+fileHashes = {}
+
+
+def fileStamp(path):
+    # absolute path, size and modification time of a file, a digest is reused as long as they don't change
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def hashFile(path):
+    # given a path to a file, return the sha256 hex digest of its content
+    # the digest is remembered, so listing a folder and parsing its files reads every file only once
+    stamp = fileStamp(path)
+    if stamp in fileHashes:
+        return fileHashes[stamp]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    fileHashes[stamp] = digest.hexdigest()
+    return fileHashes[stamp]
+
+
+def knownHashes(paths):
+    # the remembered digests of the given files, to hand them over to a worker process
+    stamps = [fileStamp(path) for path in paths]
+    return {stamp: fileHashes[stamp] for stamp in stamps if stamp in fileHashes}
+
+
+def stageKey(stage, parentKey, **params):
+    # key of a stage result: the key of its input, the stage version and every config value it depends on
+    payload = json.dumps({"stage": stage, "version": stageVersions[stage], "parent": parentKey, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    # content addressed file cache with size bounded LRU eviction
+    # recency is tracked through file modification times, so several processes can share one cache
+    # the total size is scanned once and then kept up to date by the stores of this process;
+    # the directory is only scanned again when that total goes over maxSize
+
+    def __init__(self, cacheDir=None, maxSize=config.cacheMaxSize):
+        self.cacheDir = cacheDir or os.path.join(projectPath, config.cacheDir)
+        self.maxSize = maxSize
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.totalSize = self.scan()[1]
+
+    def entryPath(self, key, extension):
+        return os.path.join(self.cacheDir, key + extension)
+
+    def fetch(self, key, extension, targetPath):
+        # copy a cached entry to targetPath, return False on a miss
+        entryPath = self.entryPath(key, extension)
+        try:
+            shutil.copyfile(entryPath, targetPath)
+            os.utime(entryPath)
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return False
+        self.stats["hits"] += 1
+        return True
+
+    def store(self, key, extension, sourcePath):
+        # copy sourcePath into the cache under key, then evict old entries if the cache is too large
+        entryPath = self.entryPath(key, extension)
+        tmpPath = entryPath + ".%d.tmp" % os.getpid()
+        shutil.copyfile(sourcePath, tmpPath)
+        self.commit(tmpPath, entryPath)
+
+    def loadJson(self, key):
+        # return a cached json object, or None on a miss
+        entryPath = self.entryPath(key, ".json")
+        try:
+            with open(entryPath, "r") as file:
+                data = json.load(file)
+            os.utime(entryPath)
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return data
+
+    def storeJson(self, key, data):
+        # write a json object into the cache under key
+        entryPath = self.entryPath(key, ".json")
+        tmpPath = entryPath + ".%d.tmp" % os.getpid()
+        with open(tmpPath, "w") as file:
+            json.dump(data, file, indent=4, ensure_ascii=False)
+        self.commit(tmpPath, entryPath)
+
+    def commit(self, tmpPath, entryPath):
+        # move a written entry into place, then evict old entries if the cache is too large
+        size = os.path.getsize(tmpPath)
+        try:
+            size -= os.path.getsize(entryPath)
+        except FileNotFoundError:
+            pass
+        os.replace(tmpPath, entryPath)
+        self.totalSize += size
+        if self.totalSize > self.maxSize:
+            self.evict()
+
+    def scan(self):
+        # return the (mtime, size, path) of every entry and their total size
+        entries = []
+        totalSize = 0
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            totalSize += stat.st_size
+        return entries, totalSize
+
+    def evict(self):
+        # remove least recently used entries until the cache fits in evictionTarget * maxSize
+        # the scan also picks up entries stored by other processes
+        entries, totalSize = self.scan()
+        if totalSize <= self.maxSize:
+            self.totalSize = totalSize
+            return
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.maxSize * evictionTarget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+            self.stats["evictions"] += 1
+        self.totalSize = totalSize
+
+    def hitRate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
@@ -2,6 +2,8 @@ import json
 import os
 import shutil
 
+from .. import config
+
 projectPath = os.path.dirname(os.path.abspath(__file__)) + "/../"
 
 
@@ -38,19 +40,25 @@ def validateFilename(inputfile: str):
 
 
 def cleanFolders():
-    # clear everything in the xml and result folder
+    # clear everything in the xml, result and cache folder
     xml_directory = projectPath + "/xmlFiles/"
     result_directory = projectPath + "/parsed_raw/"
     final_result_directory = projectPath + "/results/"
+    cache_directory = projectPath + "/" + config.cacheDir + "/"
     logPath = projectPath + '/log.txt'
     errorLogPath = projectPath + '/errorLog.txt'
+    manifestPath = projectPath + '/manifest.json'
     if os.path.exists(xml_directory):
         shutil.rmtree(xml_directory)
     if os.path.exists(result_directory):
         shutil.rmtree(result_directory)
     if os.path.exists(final_result_directory):
         shutil.rmtree(final_result_directory)
+    if os.path.exists(cache_directory):
+        shutil.rmtree(cache_directory)
     if os.path.exists(logPath):
         os.remove(logPath)
     if os.path.exists(errorLogPath):
         os.remove(errorLogPath)
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
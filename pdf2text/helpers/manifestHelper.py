@@ -0,0 +1,35 @@
+import json
+import os
+
+projectPath = os.path.dirname(os.path.abspath(__file__)) + "/../"
+manifestPath = projectPath + "/manifest.json"
+
+
+def fileSignature(path):
+    # size and modification time of a file, used to notice that a pdf changed since it was parsed
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def loadManifest(path=manifestPath):
+    # given a path to a manifest file, return {pdfPath: record}, empty if the file does not exist
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def saveManifest(manifest, path=manifestPath):
+    # write the manifest atomically, so an interrupted run never leaves a truncated file behind
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as file:
+        json.dump(manifest, file, indent=4, ensure_ascii=False)
+    os.replace(tmpPath, path)
+
+
+def isDone(manifest, pdfPath, retryFailed=False):
+    # check if a pdf was already handled by a previous run and has not changed since
+    record = manifest.get(pdfPath)
+    if record is None or record["signature"] != fileSignature(pdfPath):
+        return False
+    return record["status"] == "done" or (record["status"] == "failed" and not retryFailed)
@@ -1,20 +1,69 @@
+import re
+import xml.etree.ElementTree as ET
+
+# ascii control characters that are not tab, newline, or carriage return
+invalidAscii = [chr(0), chr(31)] + [chr(i) for i in range(1, 31) if i not in (9, 10, 13)]
+# character class deleting all of them in a single pass (much faster than str.translate on non-ascii text)
+invalidAsciiPattern = re.compile("[%s]" % "".join(invalidAscii))
+
+
+def sanitizeXML(filedata):
+    # given a chunk of SymbolScraper xml, replace all invalid xml characters with valid ones
+    # none of the patterns span a newline, so line-aligned chunks sanitize exactly like the whole file
+    filedata = filedata.replace(">&<", ">&amp;<")
+    filedata = filedata.replace("><<", ">&lt;<")
+    filedata = filedata.replace(">><", ">&gt;<")
+    return invalidAsciiPattern.sub("", filedata)
+
 
 def preParseXML(path):
     # given a path to an xml file, modify the file to make it a valid xml file
     with open(path, "r") as file:
         filedata = file.read()
-    # replace all invalid xml characters with valid ones
-    filedata = filedata.replace(">&<", ">&amp;<")
-    filedata = filedata.replace("><<", ">&lt;<")
-    filedata = filedata.replace(">><", ">&gt;<")
-    filedata = filedata.replace(chr(0), "")
-    filedata = filedata.replace("", "")
-    # remove all ascii characters that are not tab, newline, or carriage return
-    for invalidAscii in range(1, 31):
-        if invalidAscii == 9 or invalidAscii == 10 or invalidAscii == 13:
-            continue   # tab, newline, carriage return
-        char = chr(invalidAscii)
-        filedata = filedata.replace(char, "")
+    filedata = sanitizeXML(filedata)
     # write the modified xml file back to the original path
     with open(path, "w") as file:
         file.write(filedata)
+
+
+class SanitizedXMLReader:
+    # file-like wrapper that sanitizes a SymbolScraper xml file on the fly
+    # chunks are cut at the last newline so no replacement pattern is split across reads
+
+    def __init__(self, path, chunkSize=1 << 20):
+        self.file = open(path, "r")
+        self.chunkSize = chunkSize
+        self.pending = ""
+
+    def read(self, size=-1):
+        while True:
+            data = self.file.read(self.chunkSize)
+            if not data:
+                chunk, self.pending = self.pending, ""
+                return sanitizeXML(chunk)
+            data = self.pending + data
+            cut = data.rfind("\n") + 1
+            if cut:
+                self.pending = data[cut:]
+                return sanitizeXML(data[:cut])
+            self.pending = data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iterPages(path):
+    # given a path to an xml file, stream its <Page> elements without rewriting the file
+    # each page is cleared once the consumer moves on, so peak memory is bounded by one page
+    # raises ET.ParseError if the sanitized xml is still invalid
+    with SanitizedXMLReader(path) as source:
+        for event, elem in ET.iterparse(source, events=("end",)):
+            if elem.tag == "Page":
+                yield elem
+                elem.clear()
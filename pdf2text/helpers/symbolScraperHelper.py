@@ -0,0 +1,102 @@
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .. import config
+
+projectPath = os.path.dirname(os.path.abspath(__file__)) + "/../"
+sscraperPath = projectPath + "/SymbolScraper/bin/sscraper"
+
+
+def runSymbolScraper(inputPath, outputDirPath, timeout=None, command=sscraperPath):
+    # run one SymbolScraper invocation on a pdf file or a directory of pdf files
+    # the whole process group is killed on timeout so no JVM is left behind
+    # return True if the invocation finished in time, False if it timed out or could not be started
+    # (e.g. SymbolScraper was never built)
+    try:
+        process = subprocess.Popen([command, inputPath, outputDirPath], stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, start_new_session=True)
+    except OSError as e:
+        print("Error: cannot run SymbolScraper:", e)
+        return False
+    try:
+        process.wait(timeout=timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        return False
+
+
+class SymbolScraperPool:
+    # converts many pdfs with a fixed number of concurrent SymbolScraper processes
+    # pdfs are grouped into batches so one JVM start is shared by several files,
+    # and files of a failed batch are retried one by one so a bad pdf only fails itself
+
+    def __init__(self, workers=config.scraperWorkers, batchSize=config.scraperBatchSize,
+                 timeout=config.scraperTimeout, command=sscraperPath):
+        self.workers = workers
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.command = command
+
+    def convert(self, jobs):
+        # jobs: list of (pdfPath, xmlPath) pairs
+        # return a dict mapping every pdfPath to its xmlPath, or None if the conversion failed
+        results = {}
+        for batchResults in self.convertIter(jobs):
+            results.update(batchResults)
+        return results
+
+    def convertIter(self, jobs):
+        # like convert, but yield the results of every batch as soon as it is done,
+        # so the caller can work on them while the other batches are still converting
+        batches = [jobs[i: i + self.batchSize] for i in range(0, len(jobs), self.batchSize)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.convertBatch, batch) for batch in batches]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                # don't start the remaining batches if the caller stops early
+                for future in futures:
+                    future.cancel()
+
+    def convertBatch(self, batch):
+        results = {}
+        with tempfile.TemporaryDirectory(prefix="sscraper_") as workDirPath:
+            inputDirPath = os.path.join(workDirPath, "input")
+            outputDirPath = os.path.join(workDirPath, "output")
+            os.mkdir(inputDirPath)
+            os.mkdir(outputDirPath)
+            # link every pdf under a unique name, so same-named pdfs from different folders don't collide
+            for idx, (pdfPath, xmlPath) in enumerate(batch):
+                os.symlink(os.path.abspath(pdfPath), os.path.join(inputDirPath, "job%d.pdf" % idx))
+            inputPath = inputDirPath if len(batch) > 1 else os.path.join(inputDirPath, "job0.pdf")
+            finished = runSymbolScraper(inputPath, outputDirPath, self.timeout * len(batch), self.command)
+
+            failed = []
+            for idx, (pdfPath, xmlPath) in enumerate(batch):
+                outputPath = os.path.join(outputDirPath, "job%d.xml" % idx)
+                if finished and os.path.exists(outputPath):
+                    shutil.move(outputPath, xmlPath)
+                    results[pdfPath] = xmlPath
+                else:
+                    failed.append((pdfPath, xmlPath))
+
+        # isolate the failure: retry the missing files of a batch one at a time
+        if len(batch) > 1:
+            for job in failed:
+                results.update(self.convertBatch([job]))
+        else:
+            for pdfPath, xmlPath in failed:
+                results[pdfPath] = None
+        return results
+
+
+def convertFile(pdfPath, xmlPath, timeout=config.scraperTimeout, command=sscraperPath):
+    # convert a single pdf into xml at xmlPath, return True on success
+    return SymbolScraperPool(workers=1, batchSize=1, timeout=timeout, command=command).convert([(pdfPath, xmlPath)])[pdfPath] is not None
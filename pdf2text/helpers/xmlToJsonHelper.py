@@ -1,6 +1,8 @@
 import collections
 import re
 
+import numpy as np
+
 from .. import config
 
 tabWidth = config.tabWidth
@@ -15,6 +17,7 @@ weirdChar = {  # weird characters generated by Symbol Scraper that need to be re
     "fraction(-)": "",  # weird output of SymbolScraper
     "\u25a0": "",
 }
+weirdCharTable = str.maketrans({char: replacement for char, replacement in weirdChar.items() if len(char) == 1})
 
 
 def updateText(inputObject, word):
@@ -37,25 +40,58 @@ def updateText(inputObject, word):
     return inputObject
 
 
+class TextBuilder:
+    # accumulates text with the same joining rules as updateText on a string,
+    # but keeps the fragments in a list and joins them only once in build()
+
+    __slots__ = ("parts", "empty", "endsWithHyphen")
+
+    def __init__(self, text=""):
+        self.parts = [text]
+        self.empty = not text
+        self.endsWithHyphen = text.endswith("-")
+
+    def append(self, word):
+        if self.empty:
+            self.parts = [word]
+            self.empty = not word
+            self.endsWithHyphen = word.endswith("-")
+            return
+        # don't join with space if the text ends with a hyphen
+        if not self.endsWithHyphen:
+            self.parts.append(" ")
+            self.endsWithHyphen = False
+        self.parts.append(word)
+        if word:
+            self.endsWithHyphen = word[-1] == "-"
+
+    def build(self):
+        return "".join(self.parts)
+
+
 def buildWord(wordXml):
     # given an word xml element, return the word as a string
 
-    wordBuf = ""
-    for char in wordXml.iter("Char"):
-        wordBuf += (
-            weirdChar[str(char.text)] if char.text in weirdChar else str(
-                char.text)
-        )
-    return wordBuf
+    texts = [str(char.text) for char in wordXml.iter("Char")]
+    # usual case: one character per Char element, replaced in a single translate call
+    if all(len(text) == 1 for text in texts):
+        return "".join(texts).translate(weirdCharTable)
+    return "".join([weirdChar.get(text, text) for text in texts])
 
 
 def findOffset(root):
     # find the two most common line start positions
+    return findOffsetFromStarts([float(lineXml.attrib["BBOX"].split(" ")[0]) for lineXml in root.iter("Line")])
+
+
+def findOffsetFromStarts(lineStarts):
+    # find the two most common line start positions among the given xMin values, in document order
+    # lineStarts may also be an iterable of arrays, e.g. the xMin column of every page table
 
     lineStartPos = collections.defaultdict(int)
-    for lineXml in root.iter("Line"):
-        location = round(float(lineXml.attrib["BBOX"].split(" ")[0]))
-        lineStartPos[location] += 1
+    for starts in lineStarts:
+        for start in np.atleast_1d(starts).tolist():
+            lineStartPos[round(start)] += 1
     twoMean = sorted(lineStartPos.items(),
                      key=lambda x: x[1], reverse=True)[:2]
     if not twoMean:
@@ -67,12 +103,6 @@ def findOffset(root):
     return res
 
 
-def checkStartParagrph(lineXmlBBOX, paragraphStart):
-    # given a line xml element, check if it is the start of a paragraph
-    startX = float(lineXmlBBOX.split(" ")[0])
-    return roughEqual(startX-tabWidth, paragraphStart[0], 5) or roughEqual(startX-tabWidth, paragraphStart[1], 5)
-
-
 def checkEndOfPage(text):
     # given a line of text, check if it is the end of a paragraph
     # logic is done by checking if the page starts rendering graphs
@@ -85,75 +115,46 @@ def checkEndOfPage(text):
         return False
 
 
-def checkLinesFar(line1BBOX, line2BBOX):
-    # check if the start of two lines are very far from each other
-
-    threshold = 20
-    xMin1, yMin1 = line1BBOX.split(" ")[0], line1BBOX.split(" ")[1]
-    xMin2, yMin2 = line2BBOX.split(" ")[0], line2BBOX.split(" ")[1]
-    return abs(float(xMin1) - float(xMin2)) > threshold or abs(float(yMin1) - float(yMin2)) > threshold
+def parseBBOXes(lineBBOXes):
+    # given the BBOX strings of the lines of a page, return an (n, 4) array of xMin, yMin, xMax, yMax
+    # every BBOX is parsed exactly once; all paragraph heuristics work on this table
 
+    return np.array([bbox.split(" ") for bbox in lineBBOXes], dtype=float).reshape(-1, 4)
 
-def checkSameStartX(line1BBOX, line2BBOX):
-    # check if two lines start at the same x position
 
-    xMin1, yMin1 = line1BBOX.split(" ")[0], line1BBOX.split(" ")[1]
-    xMin2, yMin2 = line2BBOX.split(" ")[0], line2BBOX.split(" ")[1]
-    return roughEqual(float(xMin1), float(xMin2), 5)
+def findNewParagraphs(lineTable, offsets):
+    # given the line table of a page, flag every line that starts a new paragraph
+    # each line is compared with the previous line, where consecutive lines on the same
+    # y position are combined into one box starting at their leftmost xMin
 
+    newParagraph = np.ones(len(lineTable), dtype=bool)
+    if len(lineTable) < 2:
+        return newParagraph
+    xMin, yMin = lineTable[:, 0], lineTable[:, 1]
+    # line spacing is around 10, so using a threshold of something less than 10
+    sameLine = roughEqual(yMin[1:], yMin[:-1], 5)
 
-def checkNewParagraph(currLineBBOX, prevLineBBOX, offsets):
-    # check if new paragraph based on current line and previous line
+    # combined previous line keeps the y of the latest line and the smallest xMin of the run
+    combinedXMin = xMin.copy()
+    for i in np.flatnonzero(sameLine) + 1:
+        combinedXMin[i] = min(combinedXMin[i], combinedXMin[i - 1])
 
-    if not prevLineBBOX:
-        return True
-    xMinCurr, yMinCurr, xMaxCurr, yMaxCurr = currLineBBOX.split(" ")
-    xMinPrev, yMinPrev, xMaxPrev, yMaxPrev = prevLineBBOX.split(" ")
-    # convert to float
-    xMinCurr, yMinCurr, xMaxCurr, yMaxCurr = float(
-        xMinCurr), float(yMinCurr), float(xMaxCurr), float(yMaxCurr)
-    xMinPrev, yMinPrev, xMaxPrev, yMaxPrev = float(
-        xMinPrev), float(yMinPrev), float(xMaxPrev), float(yMaxPrev)
-    # not a new paragraph if the current line is the same as the previous line
-    if checkSameLine(currLineBBOX, prevLineBBOX):
-        return False
-    elif checkSameStartX(currLineBBOX, prevLineBBOX) and not checkLinesFar(currLineBBOX, prevLineBBOX):
-        return False
+    xMinCurr, yMinCurr = xMin[1:], yMin[1:]
+    xMinPrev, yMinPrev = combinedXMin[:-1], yMin[:-1]
+    # check if the start of two lines are very far from each other
+    linesFar = (np.abs(xMinCurr - xMinPrev) > 20) | (np.abs(yMinCurr - yMinPrev) > 20)
+    # not a new paragraph if the current line is the same as, or aligned with, the previous line
+    continued = sameLine | (roughEqual(xMinCurr, xMinPrev, 5) & ~linesFar)
     # if the current line is indented and the previous line is not
-    if xMinCurr > xMinPrev and roughEqual(xMinCurr-xMinPrev, tabWidth, 5) and roughEqual(yMinCurr - yMinPrev, lineHeight, 5):
-        return True
+    indented = (xMinCurr > xMinPrev) & roughEqual(xMinCurr - xMinPrev, tabWidth, 5) & roughEqual(yMinCurr - yMinPrev, lineHeight, 5)
     # if the current line far from the previous line, and the two lines are not in two columns
-    elif checkLinesFar(currLineBBOX, prevLineBBOX) and not (roughEqual(xMinCurr, max(offsets), 10) and roughEqual(xMinPrev, min(offsets), 10)):
-        return True
-    elif checkStartParagrph(currLineBBOX, offsets):
-        return True
-    else:
-        return False
-
-
-def checkSameLine(line1BBOX, line2BBOX):
-    # check if two line xml elements are on the same line
-
-    if not line1BBOX or not line2BBOX:
-        return False
-    y1 = float(line1BBOX.split(" ")[1])
-    y2 = float(line2BBOX.split(" ")[1])
-    # line spacing is around 10, so using a threshold of something less than 10
-    return roughEqual(y1, y2, 5)
-
-
-def combineLines(line1BBOX, line2BBOX):
-    # combine two lines of text with the same y coordinate
-
-    xMin1, yMin1, xMax1, yMax1 = line1BBOX.split(" ")
-    xMin2, yMin2, xMax2, yMax2 = line2BBOX.split(" ")
-    xMin = min(float(xMin1), float(xMin2))
-    xMax = max(float(xMax1), float(xMax2))
-    # recreate the bbox string
-    bbox = str(xMin) + " " + str(yMin1) + " " + str(xMax) + " " + str(yMax1)
-    return bbox
+    twoColumns = roughEqual(xMinCurr, max(offsets), 10) & roughEqual(xMinPrev, min(offsets), 10)
+    # if the current line starts at one of the indented paragraph start positions
+    startParagraph = roughEqual(xMinCurr - tabWidth, offsets[0], 5) | roughEqual(xMinCurr - tabWidth, offsets[1], 5)
+    newParagraph[1:] = ~continued & (indented | (linesFar & ~twoColumns) | startParagraph)
+    return newParagraph
 
 
 def roughEqual(a, b, threshold):
-    # check if two numbers are roughly equal
+    # check if two numbers (or two arrays, elementwise) are roughly equal
     return abs(a - b) < threshold
@@ -1,68 +1,90 @@
+import functools
 import json
-import math
 import os
 
 import numpy as np
-import torch
-from transformers import AutoModel, AutoTokenizer
 
 from .helpers.fileIOHelper import outputCleanJsonFile
-from .config import threshhold_value
+from .config import mpnetBackend, semanticCleaning, threshhold_value
 
-device = torch.device(0)
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+mpnet_name = "sentence-transformers/all-mpnet-base-v2"
 
-# import pretrained model
-mpnet_tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-mpnet-base-v2")
-mpnet_model = AutoModel.from_pretrained("sentence-transformers/all-mpnet-base-v2", output_hidden_states=True).to(device)
+
+def get_device():
+    # first GPU if available, CPU otherwise
+    import torch
+    return torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+
+# import pretrained model on first use, so importing this module (and parseFile) stays cheap
+# backend "int8" quantizes the linear layers dynamically, which only runs on CPU
+@functools.lru_cache(maxsize=None)
+def load_mpnet(backend=mpnetBackend):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    device = get_device() if backend == "torch" else torch.device("cpu")
+    tokenizer = AutoTokenizer.from_pretrained(mpnet_name)
+    model = AutoModel.from_pretrained(mpnet_name, output_hidden_states=True)
+    model.eval()
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model.to(device), device
 
 # driver function
 # clean noise information
 
 
-def cleanJson(jsonPath, threshold=threshhold_value):
+def cleanJson(jsonPath, threshold=threshhold_value, semantic=semanticCleaning):
+    # semantic: filter noise paragraphs with MPNet, otherwise only concatenate paragraphs split across pages
     with open(jsonPath) as fin:
         contents = fin.read()
         # Strip any leading/trailing whitespace
         contents = contents.strip()
         # Parse the JSON data
         data = json.loads(contents)
-        jsonContents = data["contents"]
-    cleaned_paragraphs = clean_paragraphs(jsonContents, threshold)
-    complete_paragraphs = concat_paragraphs(cleaned_paragraphs)
-    data["contents"] = complete_paragraphs
+    data = cleanData(data, threshold, semantic)
     filename = os.path.basename(jsonPath)[: -len(".json")]
     outputCleanJsonFile(filename, data)
-    return complete_paragraphs
+    return data["contents"]
 
-# obtain paragraph embedding
+# clean a raw json object in memory, replacing its contents with the cleaned paragraphs
 
 
-def mpnet_emb(text):
-    input_ids = (torch.tensor(mpnet_tokenizer.encode(text.lower(), max_length=512, truncation=True)).unsqueeze(0).to(device))
-    input_ids = input_ids[:, :512]
-    outputs = mpnet_model(input_ids)
-    hidden_states = outputs[2][-1][0]
-    emb = torch.mean(hidden_states, dim=0).to(device)
-    emb = np.array([float(x) for x in emb])
-    magnitude = np.linalg.norm(emb)
-    if math.isnan(magnitude):
-        emb = np.zeros(len(emb))
+def cleanData(data, threshold=threshhold_value, semantic=semanticCleaning):
+    jsonContents = data["contents"]
+    if semantic:
+        cleaned_paragraphs = clean_paragraphs(jsonContents, threshold)
     else:
-        emb = emb / magnitude
-    return emb
-
-# obtain cosine similarity score between anchor paragraphs and given paragraph
-
-
-def similarity(anchor_paragraphs, paragraph):
-    # convert sequence to id
-    paragraph_emb = mpnet_emb(paragraph)
-    similarity = 0
-    for fragment in anchor_paragraphs:
-        fragment_emb = mpnet_emb(fragment)
-        similarity += np.dot(fragment_emb, paragraph_emb)
-    return similarity / len(anchor_paragraphs)
+        cleaned_paragraphs = jsonContents
+    complete_paragraphs = concat_paragraphs(cleaned_paragraphs)
+    data["contents"] = complete_paragraphs
+    return data
+
+# obtain unit length embeddings of many paragraphs, encoded in padded batches of similar length
+
+
+def mpnet_embs(texts, batch_size=32):
+    import torch
+    mpnet_tokenizer, mpnet_model, device = load_mpnet()
+    encoded = [mpnet_tokenizer.encode(text.lower(), max_length=512, truncation=True) for text in texts]
+    # sort by length so each batch carries as little padding as possible
+    order = sorted(range(len(texts)), key=lambda i: len(encoded[i]))
+    embs = np.zeros((len(texts), mpnet_model.config.hidden_size))
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = mpnet_tokenizer.pad({"input_ids": [encoded[i] for i in batch]}, return_tensors="pt").to(device)
+            outputs = mpnet_model(**inputs)
+            hidden_states = outputs[2][-1]
+            # mean over the real tokens of each paragraph
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden_states.dtype)
+            mean = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+            embs[batch] = mean.double().cpu().numpy()
+    magnitudes = np.linalg.norm(embs, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        embs = embs / magnitudes
+    embs[np.isnan(magnitudes[:, 0])] = 0
+    return embs
 
 # given a paper, decide anchor paragraph by finding the longest paragraph in the first 1/3 of the paper
 
@@ -79,17 +101,22 @@ def get_longest_string_first_half(paper):
 # given a paragraph, filter noise information by cosine similarity score
 
 
-def clean_paragraphs(paragraphs, threshold=threshhold_value):
+def clean_paragraphs(paragraphs, threshold=threshhold_value, batch_size=32):
     cleaned_paragraphs = []
     anchor_paragraph = get_longest_string_first_half(paragraphs)
-    anchor_paragraphs = [anchor_paragraph]
-    for idx, paragraph in enumerate(paragraphs):
-        score = similarity(anchor_paragraphs, paragraph)
+    # embed every distinct paragraph (the anchor included) exactly once
+    texts = list(dict.fromkeys([anchor_paragraph] + paragraphs))
+    rows = {text: row for row, text in enumerate(texts)}
+    embs = mpnet_embs(texts, batch_size)
+    # running matrix of anchor embeddings, the score is the mean similarity to all anchors
+    anchor_embs = embs[[rows[anchor_paragraph]]]
+    for paragraph in paragraphs:
+        paragraph_emb = embs[rows[paragraph]]
+        score = np.sum(anchor_embs @ paragraph_emb) / len(anchor_embs)
         if score > threshold:
             cleaned_paragraphs.append(paragraph)
-            if len(anchor_paragraphs) == 5:
-                del anchor_paragraphs[0]
-                anchor_paragraphs.append(paragraph)
+            if len(anchor_embs) == 5:
+                anchor_embs = np.vstack([anchor_embs[1:], paragraph_emb])
     return cleaned_paragraphs
 
 # concatenate incomplete paragraphs across two pages
@@ -122,4 +149,4 @@ def concat_paragraphs(paragraphs):
 
 
 if __name__ == "__main__":
-    print("Using device:", DEVICE)
+    print("Using device:", get_device())
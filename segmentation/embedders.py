@@ -0,0 +1,90 @@
+import numpy as np
+import torch
+
+# embedder backends, see TransformerEmbedder
+BACKENDS = ['torch', 'int8']
+
+
+def quantize_int8(model):
+    """
+    dynamic int8 quantization of the linear layers, runs on CPU only
+    """
+    return torch.quantization.quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TransformerEmbedder:
+    """
+    Sentence embedder on a plain transformers model, with the same encode() interface as SentenceTransformer.
+    backend 'int8' quantizes the linear layers dynamically for fast CPU inference.
+    """
+    def __init__(self, model, tokenizer=None, pooling='cls', normalize=False, lowercase=False,
+                 backend='torch', device='cpu', max_length=512, name=None):
+        """
+        model: model name, or a loaded transformers model (e.g. a tiny random one for tests)
+        tokenizer: tokenizer of a loaded model
+        pooling: 'cls' (first token, as SPECTER) or 'mean' (over real tokens, as MPNet in pdf2text)
+        normalize: scale embeddings to unit length
+        lowercase: lowercase texts before tokenizing
+        """
+        assert backend in BACKENDS and pooling in ['cls', 'mean']
+        if isinstance(model, str):
+            from transformers import AutoModel, AutoTokenizer
+            name = name or model
+            tokenizer = AutoTokenizer.from_pretrained(model)
+            model = AutoModel.from_pretrained(model)
+        model.eval()
+        if backend == 'int8':
+            model = quantize_int8(model)
+            device = 'cpu'
+        self.model = model.to(device)
+        self.tokenizer = tokenizer
+        self.pooling = pooling
+        self.normalize = normalize
+        self.lowercase = lowercase
+        self.device = torch.device(device)
+        self.max_length = max_length
+        # name of the embeddings in an EmbeddingStore
+        self.name = '%s:%s' % (name or type(model).__name__, backend)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        sentences: list[str]
+        return float32 matrix of embeddings, sentences are sorted by length into padded batches
+        """
+        texts = [s.lower() for s in sentences] if self.lowercase else list(sentences)
+        encoded = [self.tokenizer.encode(t, max_length=self.max_length, truncation=True) for t in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(encoded[i]))
+        embeddings = np.zeros((len(texts), self.model.config.hidden_size), dtype=np.float32)
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                inputs = self.tokenizer.pad({'input_ids': [encoded[i] for i in batch]}, return_tensors='pt').to(self.device)
+                hidden_states = self.model(**inputs).last_hidden_state
+                if self.pooling == 'cls':
+                    pooled = hidden_states[:, 0]
+                else:
+                    mask = inputs['attention_mask'].unsqueeze(-1).to(hidden_states.dtype)
+                    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+                embeddings[batch] = pooled.float().cpu().numpy()
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms == 0, 1, norms)
+        return embeddings
+
+
+def specter_embedder(backend='int8', device='cpu'):
+    """
+    SPECTER as loaded by SentenceTransformer('allenai-specter'): CLS pooling, no normalization
+    """
+    return TransformerEmbedder('sentence-transformers/allenai-specter', pooling='cls',
+                               backend=backend, device=device, name='allenai-specter')
+
+
+def embedding_agreement(reference, candidate, sentences, batch_size=32):
+    """
+    return the smallest cosine similarity between the embeddings of sentences by two embedders
+    """
+    a = np.asarray(reference.encode(sentences, batch_size=batch_size), dtype=np.float64)
+    b = np.asarray(candidate.encode(sentences, batch_size=batch_size), dtype=np.float64)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return float(((a * b).sum(axis=1) / np.where(norms == 0, 1, norms)).min(initial=1.0))
@@ -0,0 +1,135 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def sentence_key(model_name, text):
+    return hashlib.sha1((model_name + '\0' + text).encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """
+    On-disk sentence embedding store, keyed by a hash of (model name, sentence).
+    Vectors (float16) and the key of each row are kept in memory-mapped files, written together,
+    so the index can always be rebuilt from disk. Recency of the rows is saved by flush().
+    When the store holds max_entries vectors, the least recently used rows are reused.
+    A store should have a single writer at a time.
+    """
+    def __init__(self, path, max_entries=1000000):
+        """
+        path: directory of the store, created if missing
+        max_entries: maximum number of stored vectors
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.vectors_path = os.path.join(path, 'vectors.f16')
+        self.keys_path = os.path.join(path, 'keys.bin')
+        self.meta_path = os.path.join(path, 'meta.npz')
+        os.makedirs(path, exist_ok=True)
+        self.dim = None
+        self.vectors = None
+        self.keys = None
+        self.rows = {}
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.clock = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        if os.path.exists(self.meta_path):
+            meta = np.load(self.meta_path)
+            self.dim = int(meta['dim'])
+            self.open(os.path.getsize(self.keys_path) // 20)
+            # rows never written have an empty key
+            live = np.flatnonzero(self.keys.any(axis=1))
+            self.rows = dict(zip((key.tobytes() for key in self.keys[live]), live.tolist()))
+            self.last_used[:min(len(meta['last_used']), len(self.last_used))] = meta['last_used'][:len(self.last_used)]
+            self.clock = int(self.last_used.max(initial=0))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def open(self, capacity):
+        # map the vector and key files with room for capacity rows
+        for path, size in [(self.vectors_path, capacity * self.dim * 2), (self.keys_path, capacity * 20)]:
+            with open(path, 'ab') as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r+', shape=(capacity, self.dim))
+        # raw sha1 digests, 20 bytes per row
+        self.keys = np.memmap(self.keys_path, dtype=np.uint8, mode='r+', shape=(capacity, 20))
+        self.last_used = np.concatenate([self.last_used, np.zeros(capacity - len(self.last_used), dtype=np.int64)])
+
+    def lookup(self, model_name, texts):
+        """
+        return float32 matrix of the stored embeddings of texts (zero rows for misses) and a boolean mask of hits
+        """
+        rows = np.array([self.rows.get(sentence_key(model_name, t), -1) for t in texts], dtype=np.int64)
+        found = rows >= 0
+        self.stats['hits'] += int(found.sum())
+        self.stats['misses'] += int(len(rows) - found.sum())
+        embeddings = np.zeros((len(texts), self.dim or 0), dtype=np.float32)
+        if found.any():
+            self.clock += 1
+            self.last_used[rows[found]] = self.clock
+            embeddings[found] = self.vectors[rows[found]]
+        return embeddings, found
+
+    def add(self, model_name, texts, embeddings):
+        """
+        store the embeddings (n, dim) of texts, evicting least recently used vectors when full
+        """
+        if len(texts) == 0:
+            return
+        embeddings = np.asarray(embeddings)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError('embedding size %d does not match the store (%d)' % (embeddings.shape[1], self.dim))
+        first = {}
+        for i, t in enumerate(texts):
+            first.setdefault(sentence_key(model_name, t), i)
+        self.clock += 1
+        # known sentences are overwritten in place, so live rows always stay at the start of the files
+        known = [(self.rows[key], i) for key, i in first.items() if key in self.rows]
+        if known:
+            rows, ids = map(list, zip(*known))
+            self.vectors[rows] = embeddings[ids]
+            self.last_used[rows] = self.clock
+        new = [(key, i) for key, i in first.items() if key not in self.rows][:self.max_entries]
+        if not new:
+            return
+        rows = self.allocate(len(new))
+        self.vectors[rows] = embeddings[[i for _, i in new]]
+        self.keys[rows] = np.frombuffer(b''.join(key for key, _ in new), dtype=np.uint8).reshape(-1, 20)
+        for (key, _), row in zip(new, rows.tolist()):
+            self.rows[key] = row
+        self.last_used[rows] = self.clock
+
+    def allocate(self, n):
+        # rows for n new vectors: unused rows at the end first, then the least recently used ones
+        used = len(self.rows)
+        free = list(range(used, min(used + n, self.max_entries)))
+        if len(free) < n:
+            victims = np.argsort(self.last_used[:used], kind='stable')[:n - len(free)].tolist()
+            for row in victims:
+                del self.rows[self.keys[row].tobytes()]
+            self.stats['evictions'] += len(victims)
+            free += victims
+        capacity = 0 if self.vectors is None else len(self.vectors)
+        if max(free) >= capacity:
+            if self.vectors is not None:
+                self.flush()
+            # grow the files geometrically
+            self.open(min(max(max(free) + 1, 2 * capacity, 1024), self.max_entries))
+        return np.array(free, dtype=np.int64)
+
+    def flush(self):
+        """
+        write the vectors, keys and recency of the rows to disk
+        """
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        self.keys.flush()
+        tmp_path = self.meta_path + '.%d.tmp.npz' % os.getpid()
+        np.savez(tmp_path, dim=self.dim, last_used=self.last_used)
+        os.replace(tmp_path, self.meta_path)
@@ -0,0 +1,124 @@
+import contextlib
+import time
+
+# TopicSegmentor stages, in pipeline order
+STAGES = ['sentence_splitting', 'keyword_matching', 'embedding', 'c99_matrices', 'boundary_search', 'alignment']
+
+
+class StageTimer:
+    """
+    Records wall time, number of calls and number of items (sentences, segments) of the TopicSegmentor stages,
+    per document. hooks are called around every stage, see ProfilerHook.
+    """
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.documents = []
+        self.current = None
+
+    def begin_document(self, **info):
+        """
+        start the report of a new document, stages are recorded into it until the next one
+        """
+        self.current = {'info': info, 'stages': {}}
+        self.documents.append(self.current)
+        return self.current
+
+    def resume(self, report):
+        """
+        record stages into a document report returned by begin_document
+        """
+        self.current = report
+
+    @contextlib.contextmanager
+    def stage(self, name, count=0, shares=None):
+        """
+        time the enclosed block as stage name of the current document
+        shares: list of (document report, count), splits the time of a block shared by several documents
+            in proportion to their counts
+        """
+        if shares is None:
+            if self.current is None:
+                self.begin_document()
+            shares = [(self.current, count)]
+        for hook in self.hooks:
+            hook.start(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            for hook in reversed(self.hooks):
+                hook.stop(name)
+            total = sum(c for _, c in shares)
+            for report, c in shares:
+                entry = report['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0, 'count': 0})
+                entry['seconds'] += seconds * (c / total if total else 1.0 / len(shares))
+                entry['calls'] += 1
+                entry['count'] += c
+
+    def report(self):
+        """
+        return {'documents': [...], 'total': {...}}, stage entries are
+            {'seconds': wall time, 'calls': timed blocks, 'count': items processed}, in pipeline order
+        """
+        total = {}
+        documents = []
+        for document in self.documents:
+            stages = {}
+            for name in STAGES + sorted(set(document['stages']) - set(STAGES)):
+                if name not in document['stages']:
+                    continue
+                stages[name] = dict(document['stages'][name])
+                entry = total.setdefault(name, {'seconds': 0.0, 'calls': 0, 'count': 0})
+                for k in entry:
+                    entry[k] += stages[name][k]
+            documents.append({'info': document['info'], 'stages': stages,
+                              'seconds': sum(e['seconds'] for e in stages.values())})
+        return {'documents': documents, 'total': total}
+
+    def reset(self):
+        self.documents = []
+        self.current = None
+
+
+class NullTimer:
+    """
+    StageTimer that records nothing, the default of TopicSegmentor
+    """
+    null = contextlib.nullcontext()
+
+    def begin_document(self, **info):
+        return None
+
+    def resume(self, report):
+        pass
+
+    def stage(self, name, count=0, shares=None):
+        return self.null
+
+
+NULL_TIMER = NullTimer()
+
+
+class ProfilerHook:
+    """
+    Runs a profiler only inside the given stages (all stages if None).
+    profiler: a cProfile.Profile (enable/disable) or a pyinstrument.Profiler (start/stop)
+    """
+    def __init__(self, profiler, stages=None):
+        self.profiler = profiler
+        self.stages = stages
+
+    def start(self, name):
+        if self.stages is None or name in self.stages:
+            if hasattr(self.profiler, 'enable'):
+                self.profiler.enable()
+            else:
+                self.profiler.start()
+
+    def stop(self, name):
+        if self.stages is None or name in self.stages:
+            if hasattr(self.profiler, 'disable'):
+                self.profiler.disable()
+            else:
+                self.profiler.stop()
@@ -1,14 +1,44 @@
-from sentence_transformers import SentenceTransformer
 import torch
 import os
 import json
-from tqdm import tqdm
-import spacy
-from collections import Counter
+import functools
+import hashlib
+from collections import Counter, deque
 import numpy as np
 
-# load core english library
-nlp = spacy.load("en_core_web_sm")
+from segmentation.profiling import NULL_TIMER
+
+# pipeline components that sentence splitting does not need, per splitting mode
+SENTENCE_MODES = {
+    # dependency parse based boundaries, identical to the full pipeline
+    'parser': ['tagger', 'attribute_ruler', 'lemmatizer', 'ner', 'senter'],
+    # statistical sentence recognizer, faster than the parser
+    'senter': ['tagger', 'attribute_ruler', 'lemmatizer', 'ner', 'parser'],
+    # punctuation rules only, no model needed
+    'rule': None,
+}
+
+# reduced precisions for the sentence embedder
+PRECISIONS = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+@functools.lru_cache(maxsize=None)
+def load_nlp(mode='parser'):
+    """
+    Load the spaCy pipeline for a sentence splitting mode on first use.
+    """
+    import spacy
+    if mode not in SENTENCE_MODES:
+        raise ValueError("Invalid sentence mode: {}".format(mode))
+    if mode == 'rule':
+        nlp = spacy.blank('en')
+        nlp.add_pipe('sentencizer')
+        return nlp
+    # load core english library
+    nlp = spacy.load("en_core_web_sm", exclude=SENTENCE_MODES[mode])
+    if mode == 'senter':
+        nlp.enable_pipe('senter')
+    return nlp
 
 
 def cosine_sim(c1, c2):
@@ -30,6 +60,75 @@ def cosine_sim(c1, c2):
     except:
         return 0
 
+def similarity_matrix(vectors):
+    """
+    vectors: sequence of n equally long vectors
+    return (n, n) matrix of pairwise cosine similarities, 0 where a norm is ~0
+    Products are accumulated sequentially in the input dtype, exactly like cosine_sim,
+    so ties in the rank matrix (e.g. on the diagonal) resolve the same way.
+    """
+    vectors = np.asarray(vectors)
+    n = len(vectors)
+    norms = np.sqrt(np.cumsum(vectors * vectors, axis=1)[:, -1])
+    sim = np.zeros((n, n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(n):
+            num = np.cumsum(vectors[i] * vectors[i:], axis=1)[:, -1]
+            den = norms[i] * norms[i:]
+            sim[i, i:] = np.where(den < 1e-9, 0, num / den)
+            sim[i:, i] = sim[i, i:]
+    return sim
+
+def rank_matrix(sim, window):
+    """
+    sim: (n, n) similarity matrix
+    return (n, n) matrix, each cell is the fraction of its (2 * window - 1)^2 neighbourhood
+    (clipped at the borders) with a strictly smaller similarity
+    """
+    n = len(sim)
+    pos = np.arange(n)
+    span = np.minimum(n - 1, pos + window - 1) - np.maximum(0, pos - window + 1) + 1
+    counts = np.zeros((n, n), dtype=np.int64)
+    for di in range(1 - window, window):
+        r1, r2 = max(0, -di), min(n, n - di)
+        for dj in range(1 - window, window):
+            c1, c2 = max(0, -dj), min(n, n - dj)
+            if r1 < r2 and c1 < c2:
+                counts[r1:r2, c1:c2] += sim[r1 + di:r2 + di, c1 + dj:c2 + dj] < sim[r1:r2, c1:c2]
+    rank = 1.0 * counts / np.outer(span, span)
+    lower = np.tril_indices(n, -1)
+    rank[lower] = rank.T[lower]
+    return rank
+
+def sum_matrix(rank):
+    """
+    rank: (n, n) rank matrix
+    return (n, n) matrix, cell (i, j) is the sum of rank[i:j+1, i:j+1]
+    The 2d prefix sums are filled one anti-diagonal at a time with the same
+    operation order as the cell by cell recurrence, so results are bit identical.
+    """
+    n = len(rank)
+    prefix_sm = np.zeros((n, n))
+    for k in range(2 * n - 1):
+        i = np.arange(max(0, k - n + 1), min(k, n - 1) + 1)
+        j = k - i
+        cur = rank[i, j]
+        up, left = i >= 1, j >= 1
+        both = up & left
+        cur[up] += prefix_sm[i[up] - 1, j[up]]
+        cur[left] += prefix_sm[i[left], j[left] - 1]
+        cur[both] -= prefix_sm[i[both] - 1, j[both] - 1]
+        prefix_sm[i, j] = cur
+    i, j = np.triu_indices(n)
+    tot = prefix_sm[j, j]
+    inner = i > 0
+    ii, jj = i[inner], j[inner]
+    tot[inner] = prefix_sm[jj, jj] - prefix_sm[ii - 1, jj] - prefix_sm[jj, ii - 1] + prefix_sm[ii - 1, ii - 1]
+    sm = np.zeros((n, n))
+    sm[i, j] = tot
+    sm[j, i] = tot
+    return sm
+
 class EnglishTokenizer:
     """
     A tokenizer is a class with tokenize(text) method
@@ -58,6 +157,8 @@ class C99:
         self.sm = None
         self.std_coeff = std_coeff
         self.tokenizer = tokenizer
+        # StageTimer recording the matrix build and boundary search, see profiling.py
+        self.timer = NULL_TIMER
 
     def segment(self, document):
         """
@@ -78,104 +179,92 @@ class C99:
         
         
 
-        # step 2, compute similarity matrix
-        self.sim = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i, n):
-                self.sim[i][j] = cosine_sim(cnts[i], cnts[j])
-                self.sim[j][i] = self.sim[i][j]
+        with self.timer.stage('c99_matrices', n):
+            # step 2, compute similarity matrix
+            self.sim = similarity_matrix(cnts)
 
-        # step 3, compute rank matrix & sum matrix
-        self.rank = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i, n):
-                r1 = max(0, i - self.window + 1)
-                r2 = min(n - 1, i + self.window - 1)
-                c1 = max(0, j - self.window + 1)
-                c2 = min(n - 1, j + self.window - 1)
-                sublist = self.sim[r1:(r2 + 1), c1:(c2+1)].flatten()
-                lowlist = [x for x in sublist if x < self.sim[i][j]]
-                self.rank[i][j] = 1.0 * len(lowlist) / ((r2 - r1 + 1) * (c2 - c1 + 1))
-                self.rank[j][i] = self.rank[i][j]
-
-        self.sm = np.zeros((n, n))
-        # O(n^4) solution
-        # for i in xrange(n):
-        #     for j in xrange(i, n):
-        #         self.sm[i][j] = sum(self.rank[i:(j + 1), i:(j + 1)].flatten())
-        #         self.sm[j][i] = self.sm[i][j]
-        # O(n^2) solution
-        prefix_sm = np.zeros((n, n))
-        for i in range(n):
-            for j in range(n):
-                prefix_sm[i][j] = self.rank[i][j]
-                if i - 1 >= 0: prefix_sm[i][j] += prefix_sm[i - 1][j]
-                if j - 1 >= 0: prefix_sm[i][j] += prefix_sm[i][j - 1]
-                if i - 1 >= 0 and j - 1 >= 0: prefix_sm[i][j] -= prefix_sm[i - 1][j - 1]
-        for i in range(n):
-            for j in range(i, n):
-                if i == 0:
-                    self.sm[i][j] = prefix_sm[j][j]
+            # step 3, compute rank matrix & sum matrix
+            self.rank = rank_matrix(self.sim, self.window)
+            self.sm = sum_matrix(self.rank)
+
+        with self.timer.stage('boundary_search', n):
+            # step 4, determine boundaries
+            # each region is split once, when it is created, and its candidate split is kept in flat arrays
+            # (one slot per region) so choosing the next split is a single vectorized pass.
+            # the choice depends on the global density, so it is re-scored every step rather than kept in a heap
+            D = 1.0 * self.sm[0][n - 1] / (n * n)
+            darr, idx = [D], []
+            sum_region, sum_area = float(self.sm[0][n - 1]), float(n * n)
+            region_arr = []
+            left, active = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool)
+            tot, lch_tot, rch_tot = np.zeros(n), np.zeros(n), np.zeros(n)
+            area, lch_area, rch_area = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+
+            def place(slot, region):
+                if slot == len(region_arr):
+                    region_arr.append(region)
                 else:
-                    self.sm[i][j] = prefix_sm[j][j] - prefix_sm[i - 1][j] \
-                                    - prefix_sm[j][i - 1] + prefix_sm[i - 1][i - 1]
-                self.sm[j][i] = self.sm[i][j]
-
-        # step 4, determine boundaries
-        D = 1.0 * self.sm[0][n - 1] / (n * n)
-        darr, region_arr, idx = [D], [Region(0, n - 1, self.sm)], []
-        sum_region, sum_area = float(self.sm[0][n - 1]), float(n * n)
-        for i in range(n - 1):
-            mx, pos = -1e9, -1
-            for j, region in enumerate(region_arr):
-                if region.l == region.r:
-                    continue
-                region.split(self.sm)
-                den = sum_area - region.area + region.lch.area + region.rch.area
-                cur = (sum_region - region.tot + region.lch.tot + region.rch.tot) / den
-                if cur > mx:
-                    mx, pos = cur, j
-            assert(pos >= 0)
-            tmp = region_arr[pos]
-            region_arr[pos] = tmp.rch
-            region_arr.insert(pos, tmp.lch)
-            sum_region += tmp.lch.tot + tmp.rch.tot - tmp.tot
-            sum_area += tmp.lch.area + tmp.rch.area - tmp.area
-            darr.append(sum_region / sum_area)
-            idx.append(tmp.best_pos)
-
-        dgrad = [(darr[i + 1] - darr[i]) for i in range(len(darr) - 1)]
-
-        # optional step, smooth gradient
-        smooth_dgrad = [dgrad[i] for i in range(len(dgrad))]
-        if len(dgrad) > 1:
-            smooth_dgrad[0] = (dgrad[0] * 2 + dgrad[1]) / 3.0
-            smooth_dgrad[-1] = (dgrad[-1] * 2 + dgrad[-2]) / 3.0
-        for i in range(1, len(dgrad) - 1):
-            smooth_dgrad[i] = (dgrad[i - 1] + 2 * dgrad[i] + dgrad[i + 1]) / 4.0
-        dgrad = smooth_dgrad
-
-        avg, stdev = np.average(dgrad), np.std(dgrad)
-        cutoff = avg + self.std_coeff * stdev
-        assert(len(idx) == len(dgrad))
-        above_cutoff_idx = [i for i in range(len(dgrad)) if dgrad[i] >= cutoff]
-        if len(above_cutoff_idx) == 0: boundary = []
-        else: boundary = idx[:max(above_cutoff_idx) + 1]
-        ret = [0 for _ in range(n)]
-        for i in boundary:
-            ret[i] = 1
-            # boundary should not be too close
-            for j in range(i - 1, i + 2):
-                if j >= 0 and j < n and j != i and ret[j] == 1:
-                    ret[i] = 0
-                    break
-        return [1] + ret[:-1]
+                    region_arr[slot] = region
+                left[slot] = region.l
+                active[slot] = region.l < region.r
+                if active[slot]:
+                    region.split(self.sm)
+                    tot[slot], lch_tot[slot], rch_tot[slot] = region.tot, region.lch.tot, region.rch.tot
+                    area[slot], lch_area[slot], rch_area[slot] = region.area, region.lch.area, region.rch.area
+                else:
+                    tot[slot] = lch_tot[slot] = rch_tot[slot] = 0
+                    area[slot] = lch_area[slot] = rch_area[slot] = 0
+
+            place(0, Region(0, n - 1, self.sm))
+            for i in range(n - 1):
+                den = sum_area - area + lch_area + rch_area
+                cur = np.where(active, (sum_region - tot + lch_tot + rch_tot) / den, -np.inf)
+                # on ties take the leftmost region in the document
+                candidates = np.flatnonzero(cur == cur.max())
+                pos = candidates[np.argmin(left[candidates])]
+                assert(active[pos])
+                tmp = region_arr[pos]
+                place(pos, tmp.lch)
+                place(len(region_arr), tmp.rch)
+                sum_region += tmp.lch.tot + tmp.rch.tot - tmp.tot
+                sum_area += tmp.lch.area + tmp.rch.area - tmp.area
+                darr.append(sum_region / sum_area)
+                idx.append(tmp.best_pos)
+
+            dgrad = [(darr[i + 1] - darr[i]) for i in range(len(darr) - 1)]
+
+            # optional step, smooth gradient
+            smooth_dgrad = [dgrad[i] for i in range(len(dgrad))]
+            if len(dgrad) > 1:
+                smooth_dgrad[0] = (dgrad[0] * 2 + dgrad[1]) / 3.0
+                smooth_dgrad[-1] = (dgrad[-1] * 2 + dgrad[-2]) / 3.0
+            for i in range(1, len(dgrad) - 1):
+                smooth_dgrad[i] = (dgrad[i - 1] + 2 * dgrad[i] + dgrad[i + 1]) / 4.0
+            dgrad = smooth_dgrad
+
+            avg, stdev = np.average(dgrad), np.std(dgrad)
+            cutoff = avg + self.std_coeff * stdev
+            assert(len(idx) == len(dgrad))
+            above_cutoff_idx = [i for i in range(len(dgrad)) if dgrad[i] >= cutoff]
+            if len(above_cutoff_idx) == 0: boundary = []
+            else: boundary = idx[:max(above_cutoff_idx) + 1]
+            ret = [0 for _ in range(n)]
+            for i in boundary:
+                ret[i] = 1
+                # boundary should not be too close
+                for j in range(i - 1, i + 2):
+                    if j >= 0 and j < n and j != i and ret[j] == 1:
+                        ret[i] = 0
+                        break
+            return [1] + ret[:-1]
 
 class Region:
     """
     Used to denote a rectangular region of similarity matrix,
     never instantiate this class outside the package.
     """
+    __slots__ = ('tot', 'l', 'r', 'area', 'lch', 'rch', 'best_pos')
+
     def __init__(self, l, r, sm_matrix):
         assert(r >= l)
         self.tot = sm_matrix[l][r]
@@ -191,60 +280,264 @@ class Region:
             self.best_pos = self.l
             return
         assert(self.r > self.l)
-        mx, pos = -1e9, -1
-        for i in range(self.l, self.r):
-            carea = (i - self.l + 1)**2 + (self.r - i)**2
-            cur = (sm_matrix[self.l][i] + sm_matrix[i + 1][self.r]) / carea
-            if cur > mx:
-                mx, pos = cur, i
+        i = np.arange(self.l, self.r)
+        carea = (i - self.l + 1)**2 + (self.r - i)**2
+        cur = (sm_matrix[self.l, self.l:self.r] + sm_matrix[self.l + 1:self.r + 1, self.r]) / carea
+        pos = self.l + int(np.argmax(cur))
         assert(pos >= self.l and pos < self.r)
         self.lch = Region(self.l, pos, sm_matrix)
         self.rch = Region(pos + 1, self.r, sm_matrix)
         self.best_pos = pos
 
 
+class KeywordIndex:
+    """
+    Aho-Corasick automaton over a keyword list, built once.
+    A keyword matches wherever it occurs as a substring, exactly like `keyword in text`,
+    but all keywords are searched in a single pass over the text.
+    """
+    def __init__(self, keywords):
+        self.keywords = [k for k in dict.fromkeys(keywords) if k]
+        self.match_empty = '' in keywords
+        # trie of the keywords
+        goto, output = [{}], [[]]
+        for k_id, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                if ch not in goto[state]:
+                    goto[state][ch] = len(goto)
+                    goto.append({})
+                    output.append([])
+                state = goto[state][ch]
+            output[state].append(k_id)
+        # breadth first: failure links, merged outputs and full transition tables
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            output[state] = output[state] + output[fail[state]]
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+        self.delta = delta
+        self.output = output
+
+    def contains(self, text):
+        """
+        return True if any keyword occurs in text
+        """
+        if self.match_empty:
+            return True
+        delta, output, state = self.delta, self.output, 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if output[state]:
+                return True
+        return False
+
+    def find_all(self, text):
+        """
+        return list of (start, keyword) for every occurrence of every keyword, ordered by end position
+        """
+        matches = [(i, '') for i in range(len(text) + 1)] if self.match_empty else []
+        delta, output, state = self.delta, self.output, 0
+        for end, ch in enumerate(text, 1):
+            state = delta[state].get(ch, 0)
+            for k_id in output[state]:
+                keyword = self.keywords[k_id]
+                matches.append((end - len(keyword), keyword))
+        return matches
+
+class NearDuplicateFilter:
+    """
+    Flags texts that nearly repeat an earlier one: MinHash signatures of word shingles are banded (LSH)
+    to find candidates, whose exact shingle Jaccard similarity is then compared with threshold.
+    """
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, shingle_size=3, seed=1):
+        assert num_perm % bands == 0
+        self.threshold = threshold
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.buckets = {}
+        self.shingle_sets = []
+
+    def shingles(self, text):
+        tokens = text.lower().split()
+        n = self.shingle_size
+        if len(tokens) <= n:
+            return {' '.join(tokens)}
+        return {' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+    def signature(self, shingles):
+        # 32 bit hashes, so a * h + b stays below 2 ** 64
+        hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little')
+                           for s in shingles], dtype=np.uint64)
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(self.PRIME)).min(axis=1)
+
+    def check(self, text):
+        """
+        return True if text is a near duplicate of a text seen before, otherwise remember it and return False
+        """
+        shingles = self.shingles(text)
+        bands = [(i, band.tobytes()) for i, band in enumerate(np.split(self.signature(shingles), self.bands))]
+        candidates = {c for band in bands for c in self.buckets.get(band, ())}
+        for c in sorted(candidates):
+            other = self.shingle_sets[c]
+            if len(shingles & other) >= self.threshold * len(shingles | other):
+                return True
+        for band in bands:
+            self.buckets.setdefault(band, []).append(len(self.shingle_sets))
+        self.shingle_sets.append(shingles)
+        return False
+
 class TopicSegmentor:
-    def __init__(self, device='cuda:0', keywords=None):
+    def __init__(self, device='cuda:0', keywords=None, sentence_mode='parser', batch_size=64, n_process=1,
+                 encode_batch_size=128, precision=None, embedding_store=None, near_duplicate_threshold=None,
+                 embedder=None, timer=None):
+        """
+        sentence_mode: 'parser' (same sentences as the full spaCy pipeline), 'senter' or 'rule', see SENTENCE_MODES
+        batch_size, n_process: batching and worker processes of spaCy's nlp.pipe
+        encode_batch_size: sentences per SPECTER batch, sentences of a whole document are encoded together
+        precision: None (float32), 'fp16' (GPU only) or 'bf16', see PRECISIONS
+        embedding_store: optional EmbeddingStore consulted before encoding, see embedding_store.py
+        near_duplicate_threshold: if set, also drop segments whose word-shingle Jaccard similarity
+            to an earlier segment of the document is at least this value, see NearDuplicateFilter
+        embedder: object with encode(sentences, batch_size) returning a matrix, e.g. a CPU-quantized
+            TransformerEmbedder from embedders.py; SentenceTransformer('allenai-specter') if None
+        timer: StageTimer collecting per-document stage timings, see profiling.py
+        """
         self.device = torch.device(device)
-        # self.embedder = SentenceTransformer('bert-base-nli-stsb-mean-tokens')
-        self.embedder = SentenceTransformer('allenai-specter')
+        self.sentence_mode = sentence_mode
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.encode_batch_size = encode_batch_size
+        self.sentence_transformer = embedder is None
+        if embedder is None:
+            from sentence_transformers import SentenceTransformer
+            # self.embedder = SentenceTransformer('bert-base-nli-stsb-mean-tokens')
+            self.embedder = SentenceTransformer('allenai-specter')
+            # name of the embeddings in the store, reduced precision gives different vectors
+            self.embedder_name = 'allenai-specter'
+            if precision is not None and (self.embedder.device.type == 'cuda' or precision == 'bf16'):
+                self.embedder.to(PRECISIONS[precision])
+                self.embedder_name += ':' + precision
+        else:
+            self.embedder = embedder
+            self.embedder_name = getattr(embedder, 'name', type(embedder).__name__)
+        self.embedding_store = embedding_store
+        self.near_duplicate_threshold = near_duplicate_threshold
         if keywords == None:
             with open('segmentation/Keywords.txt') as f:
                 kws = f.readlines()
             self.keywords = [kw.strip() for kw in kws]
         else:
             self.keywords = keywords
+        self.keyword_index = KeywordIndex(self.keywords)
         self.model = C99(window = 4, std_coeff = 1)
+        self.timer = timer or NULL_TIMER
+        self.model.timer = self.timer
 
     def init_keyword(self, sent, keyword_dict):
+        if keyword_dict is self.keywords:
+            return self.keyword_index.contains(sent)
         for k in keyword_dict:
             if k in sent:
                 return True
         return False
 
-    def segment(self, context):
-        pos = []
-        sentences = []
-        for c_id, sent in enumerate(context):
-            doc = nlp(sent)
-            sentence = []
-            for s_id, s in enumerate(doc.sents):
-                if self.init_keyword(str(s), self.keywords):
-                    pos.append([c_id, s_id])
-                sentence.append(str(s))
-            sentences.append(sentence)
-
-        ### Compute embeddings for topic tagging ###
-        embeddings = []
+    def match_keywords(self, text):
+        """
+        return list of (start, keyword) for every keyword occurrence in text
+        """
+        return self.keyword_index.find_all(text)
+
+    def split_sentences(self, context):
+        """
+        context: list[str], paragraphs
+        return iterator over the spaCy docs of the paragraphs, processed in batches
+        """
+        nlp = load_nlp(self.sentence_mode)
+        return nlp.pipe(context, batch_size=self.batch_size, n_process=self.n_process)
+
+    def encode_paragraphs(self, paragraphs):
+        """
+        paragraphs: list[list[str]], sentences of each paragraph
+        return list of sentence embedding matrices, one per paragraph
+        all sentences are encoded in one call, sentence-transformers sorts them by length into padded batches
+        """
+        sents = flat(paragraphs)
+        if not sents:
+            return [np.zeros((0, 0), dtype=np.float32) for _ in paragraphs]
+        embeddings = self.encode_sentences(sents)
+        offsets = np.cumsum([len(p) for p in paragraphs])[:-1]
+        return np.split(embeddings, offsets)
+
+    def encode_sentences(self, sents):
+        """
+        sents: list[str], non-empty
+        return float32 matrix of sentence embeddings, taken from the embedding store when possible
+        """
+        if self.embedding_store is None:
+            return self.run_embedder(sents)
+        store = self.embedding_store
+        embeddings, found = store.lookup(self.embedder_name, sents)
+        missing = list(dict.fromkeys(s for s, f in zip(sents, found) if not f))
+        if missing:
+            # stored vectors are float16, round fresh ones the same way so results do not depend on the store
+            new = self.run_embedder(missing).astype(np.float16)
+            store.add(self.embedder_name, missing, new)
+            store.flush()
+            if embeddings.shape[1] == 0:
+                embeddings = np.zeros((len(sents), new.shape[1]), dtype=np.float32)
+            row = {s: i for i, s in enumerate(missing)}
+            embeddings[~found] = new[[row[s] for s, f in zip(sents, found) if not f]]
+        return embeddings
+
+    def run_embedder(self, sents):
+        if not self.sentence_transformer:
+            return np.asarray(self.embedder.encode(sents, batch_size=self.encode_batch_size), dtype=np.float32)
         with torch.no_grad():
-            for i in tqdm(range(0, len(sentences))):
-                #tokens_input = tokenize_conv(sent[i]).cuda()
-                embedding = self.embedder.encode(sentences[i])
-                embeddings.append(embedding)
-
-        ### Get the topic taggings ###
-        sent_label = []
-        for i in range(0, len(embeddings)):
+            embeddings = self.embedder.encode(sents, batch_size=self.encode_batch_size,
+                                              show_progress_bar=True, convert_to_tensor=True)
+        return embeddings.float().cpu().numpy()
+
+    def keyword_sentences(self, context):
+        """
+        context: list[str], paragraphs
+        return sentences of each paragraph and [paragraph id, sentence id] of the sentences with keywords
+        """
+        with self.timer.stage('sentence_splitting', len(context)):
+            sentences = [[str(s) for s in doc.sents] for doc in self.split_sentences(context)]
+        with self.timer.stage('keyword_matching', sum(len(sentence) for sentence in sentences)):
+            pos = []
+            for c_id, sentence in enumerate(sentences):
+                for s_id, s in enumerate(sentence):
+                    if self.init_keyword(s, self.keywords):
+                        pos.append([c_id, s_id])
+        return sentences, pos
+
+    def topic_segments(self, sentences, pos, embeddings):
+        """
+        embeddings: dict, paragraph id -> sentence embeddings, for every paragraph in pos
+        return the segments around the keyword sentences
+        """
+        ### Get the topic taggings, only for paragraphs with keyword hits ###
+        sent_label = {}
+        for i in range(0, len(sentences)):
+            if i not in embeddings:
+                # C99 keeps the smallest window it has seen, replay that so the taggings stay the same
+                if len(sentences[i]) >= 3:
+                    self.model.window = min(self.model.window, len(sentences[i]))
+                continue
             boundary = self.model.segment(embeddings[i])
             temp_labels = []
             l = 0
@@ -252,31 +545,81 @@ class TopicSegmentor:
                 if boundary[j] == 1:
                     l += 1
                 temp_labels.append(l)
-            sent_label.append(temp_labels)
+            sent_label[i] = temp_labels
 
         ### Align topic taggins with sentences ###
-        res = []
-        for item in pos:
-            context = sentences[item[0]]
-            topic = sent_label[item[0]]
-            assert len(context) == len(topic)
-            exact_topic = topic[item[1]]
-
-            subres = []
-            for t_id in range(len(topic)):
-                if topic[t_id] == exact_topic:
-                    subres.append(context[t_id])
-            if subres not in res:
-                res.append(subres)
+        with self.timer.stage('alignment', len(pos)):
+            res = []
+            seen = set()
+            near_duplicates = self.near_duplicate_filter()
+            for item in pos:
+                context = sentences[item[0]]
+                topic = sent_label[item[0]]
+                assert len(context) == len(topic)
+                exact_topic = topic[item[1]]
+
+                subres = []
+                for t_id in range(len(topic)):
+                    if topic[t_id] == exact_topic:
+                        subres.append(context[t_id])
+                key = tuple(subres)
+                if key not in seen:
+                    seen.add(key)
+                    if near_duplicates is None or not near_duplicates.check(' '.join(subres)):
+                        res.append(subres)
 
         return flat(res)
-    
-    def segment_si(self, context):
+
+    def segment(self, context):
+        return self.segment_batch([context])[0]
+
+    def segment_batch(self, contexts):
+        """
+        contexts: list of documents, each a list of paragraphs
+        return list with the segment() result of each document,
+            the sentences of all documents are encoded together
+        """
+        reports, split = [], []
+        for context in contexts:
+            reports.append(self.timer.begin_document(paragraphs=len(context)))
+            split.append(self.keyword_sentences(context))
+        hits = [sorted({c_id for c_id, _ in pos}) for _, pos in split]
+        # encoding is shared by the documents, its time is split by their number of sentences
+        shares = [(report, sum(len(split[d][0][i]) for i in hits[d])) for d, report in enumerate(reports)]
+        with self.timer.stage('embedding', shares=shares):
+            embeddings = iter(self.encode_paragraphs([split[d][0][i] for d in range(len(split)) for i in hits[d]]))
         res = []
-        for para in context:
-            if self.init_keyword(para, self.keywords) and (para not in res):
-                res.append(para)
+        for (sentences, pos), ids, report in zip(split, hits, reports):
+            self.timer.resume(report)
+            res.append(self.topic_segments(sentences, pos, {i: next(embeddings) for i in ids}))
         return res
+
+    def segment_si(self, context):
+        self.timer.begin_document(paragraphs=len(context))
+        with self.timer.stage('keyword_matching', len(context)):
+            res = []
+            seen = set()
+            near_duplicates = self.near_duplicate_filter()
+            for para in context:
+                if self.init_keyword(para, self.keywords) and (para not in seen):
+                    seen.add(para)
+                    if near_duplicates is None or not near_duplicates.check(para):
+                        res.append(para)
+        return res
+
+    def near_duplicate_filter(self):
+        if self.near_duplicate_threshold is None:
+            return None
+        return NearDuplicateFilter(self.near_duplicate_threshold)
     
+def segmentation_agreement(reference, candidate, contexts):
+    """
+    reference, candidate: TopicSegmentor, e.g. with the default embedder and with a quantized one
+    contexts: reference documents, each a list of paragraphs
+    return ids of the documents whose segments differ
+    """
+    expected = reference.segment_batch(contexts)
+    return [i for i, res in enumerate(candidate.segment_batch(contexts)) if res != expected[i]]
+
 def flat(res):
     return [segments for paragraphs in res for segments in paragraphs]